@@ -1,15 +1,13 @@
 #!/usr/bin/env python3
-import os
-import json
 import logging
-import time
 
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from gspread_dataframe import set_with_dataframe
 from gspread.exceptions import APIError
 
+from sheets_client import api_retry, open_spreadsheet, open_worksheet, fetch_all_values
+from source_state import sources_changed, remember
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 # ——— КОНСТАНТЫ ———
@@ -18,47 +16,124 @@ SRC_SHEET_NAME = "Lessons"
 
 DST_SS_ID      = "1HItT2-PtZWoldYKL210hCQOLg3rh6U1Qj6NWkBjDjzk"
 DST_SHEET_NAME = "QA - Lesson evaluation"
+
+# "copy" — перенос колонок на стороне Sheets (copyTo + copyPaste), значения не проходят через нас;
+# "values" — чтение листа и запись значений, как раньше
+TRANSFER_MODE  = "copy"
+# Колонки источника (0-based) -> колонки приёмника, начиная с A
+COLUMN_MAP     = [0, 1, 14, 11]   # A -> A, B -> B, O -> C, L -> D
+CLEAR_ROWS     = 50000            # приёмник чистим в A2:D{CLEAR_ROWS}
 # —————————————————
 
-SERVICE_ACCOUNT_JSON = json.loads(os.environ["GCP_SERVICE_ACCOUNT"])
+def grid_range(sheet_id, row0, row1, col0, col1):
+    """GridRange (0-based, конец не включается); None — без границы."""
+    rng = {"sheetId": sheet_id, "startRowIndex": row0, "startColumnIndex": col0, "endColumnIndex": col1}
+    if row1 is not None:
+        rng["endRowIndex"] = row1
+    return rng
+
+def copy_requests(tmp_id, tmp_rows, dst_id, dst_rows):
+    """
+    batchUpdate-запросы для приёмника: очистить A2:D, дорастить лист при необходимости,
+    вставить значения колонок из временной копии источника и удалить её.
+    """
+    width = len(COLUMN_MAP)
+    reqs = [{"updateCells": {
+        "range": grid_range(dst_id, 1, min(CLEAR_ROWS, dst_rows), 0, width),
+        "fields": "userEnteredValue",
+    }}]
+    if tmp_rows > dst_rows:
+        reqs.append({"appendDimension": {"sheetId": dst_id, "dimension": "ROWS", "length": tmp_rows - dst_rows}})
+    for dst_col, src_col in enumerate(COLUMN_MAP):
+        reqs.append({"copyPaste": {
+            "source": grid_range(tmp_id, 1, tmp_rows, src_col, src_col + 1),
+            "destination": grid_range(dst_id, 1, tmp_rows, dst_col, dst_col + 1),
+            "pasteType": "PASTE_VALUES",
+        }})
+    reqs.append({"deleteSheet": {"sheetId": tmp_id}})
+    return reqs
+
+def drop_leftover_copies(sh_dst, title):
+    """
+    Удаляет из приёмника копии листа-источника ("Copy of Lessons", "Copy of Lessons 2", …),
+    оставшиеся от copyTo, который дошёл до сервера, но ответ на него потерялся.
+    """
+    prefix = f"Copy of {title}"
+    leftovers = [ws.id for ws in api_retry(sh_dst.worksheets)
+                 if ws.title == prefix or ws.title.startswith(prefix + " ")]
+    if leftovers:
+        logging.warning(f"Удаляем {len(leftovers)} оставшихся копий листа {title!r} в приёмнике")
+        api_retry(sh_dst.batch_update, {"requests": [{"deleteSheet": {"sheetId": i}} for i in leftovers]})
+
+def server_copy():
+    """
+    Перенос без скачивания: лист Lessons копируется в таблицу приёмника (sheets.copyTo),
+    колонки раскладываются copyPaste, временная копия удаляется — всё одним batchUpdate.
+    """
+    ws_src = open_worksheet(SRC_SS_ID, SRC_SHEET_NAME)
+    ws_dst = open_worksheet(DST_SS_ID, DST_SHEET_NAME)
+    sh_dst = open_spreadsheet(DST_SS_ID)
 
-def api_retry(func, *args, max_attempts=5, initial_backoff=1.0, **kwargs):
-    backoff = initial_backoff
-    for attempt in range(1, max_attempts + 1):
+    # copyTo не идемпотентен: повтор после потерянного ответа создал бы вторую копию,
+    # поэтому перед каждым повтором убираем то, что успел создать предыдущий вызов
+    attempts = []
+    def copy_to():
+        if attempts:
+            drop_leftover_copies(sh_dst, ws_src.title)
+        attempts.append(1)
+        return ws_src.copy_to(DST_SS_ID)
+    tmp = api_retry(copy_to)
+    tmp_id = tmp["sheetId"]
+    tmp_rows = tmp["gridProperties"]["rowCount"]
+    try:
+        body = {"requests": copy_requests(tmp_id, tmp_rows, ws_dst.id, ws_dst.row_count)}
+        api_retry(sh_dst.batch_update, body)
+    except Exception:
+        # временный лист не должен остаться в таблице приёмника
+        api_retry(sh_dst.batch_update, {"requests": [{"deleteSheet": {"sheetId": tmp_id}}]})
+        raise
+    logging.info(f"✔ Колонки A, B, O, L скопированы на стороне Sheets ({tmp_rows - 1} строк), без скачивания")
+
+def main(lessons_df=None):
+    """
+    lessons_df — кадр A..O, только что записанный update_lessons.main() в лист Lessons
+    (передаётся пайплайном). Нужен только в режиме "values": если его нет, читаем лист из Sheets.
+    При TRANSFER_MODE="copy" (по умолчанию) кадр не используется — он пригождается лишь
+    при откате на "values", если серверное копирование не прошло.
+    """
+    # 0) Если источник не менялся с прошлого успешного запуска — ничего не делаем
+    changed, fingerprints = sources_changed("qa_rating_update", [SRC_SS_ID])
+    if not changed:
+        logging.info("✔ Источник не менялся, пропускаем запуск")
+        return None
+
+    # 1) Перенос на стороне Sheets — значения не проходят через раннер
+    if TRANSFER_MODE == "copy":
         try:
-            return func(*args, **kwargs)
+            server_copy()
+            remember("qa_rating_update", fingerprints)
+            return None
         except APIError as e:
-            code = None
-            if e.response:
-                code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and attempt < max_attempts:
-                logging.warning(f"Ошибка API {code}, повтор через {backoff}с...")
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            raise
-
-def main():
-    # 1) Авторизация
-    scope  = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds  = ServiceAccountCredentials.from_json_keyfile_dict(SERVICE_ACCOUNT_JSON, scope)
-    client = gspread.authorize(creds)
-    logging.info("✔ Авторизация выполнена")
-
-    # 2) Получение всех данных из источника (Лист Lessons)
-    sh_src = api_retry(client.open_by_key, SRC_SS_ID)
-    ws_src = sh_src.worksheet(SRC_SHEET_NAME)
-    
-    # Забираем всё содержимое листа (включая пустые строки)
-    all_rows = api_retry(ws_src.get_all_values)
-    if not all_rows:
-        logging.warning("Источник пуст.")
-        return
-
-    # 3) Выбор колонок A(0), B(1), O(14), L(11)
-    # Начинаем со 2-й строки (индекс [1:]), чтобы не тащить старые заголовки
+            logging.warning(f"Серверное копирование не прошло ({e}), переносим значения…")
+
+    # 1) Получение всех данных из источника (Лист Lessons)
+    if lessons_df is not None:
+        data_rows = lessons_df.values.tolist()
+        logging.info(f"✔ Lessons получены из пайплайна ({len(data_rows)} строк), чтение листа пропущено")
+    else:
+        ws_src = open_worksheet(SRC_SS_ID, SRC_SHEET_NAME)
+
+        # Забираем всё содержимое листа (включая пустые строки)
+        all_rows = fetch_all_values(ws_src)
+        if not all_rows:
+            logging.warning("Источник пуст.")
+            return None
+        # Начинаем со 2-й строки (индекс [1:]), чтобы не тащить старые заголовки
+        data_rows = all_rows[1:]
+
+    # 2) Выбор колонок A(0), B(1), O(14), L(11)
     extracted_data = []
-    for row in all_rows[1:]:
+    for row in data_rows:
         # Добиваем строку до индекса 14, если она короче
         if len(row) < 15:
             row += [""] * (15 - len(row))
@@ -74,9 +149,8 @@ def main():
     df = pd.DataFrame(extracted_data)
     logging.info(f"✔ Подготовлено {len(df)} строк для переноса")
 
-    # 4) Полная перезапись целевой таблицы (только колонки A-D)
-    sh_dst = api_retry(client.open_by_key, DST_SS_ID)
-    ws_dst = sh_dst.worksheet(DST_SHEET_NAME)
+    # 3) Полная перезапись целевой таблицы (только колонки A-D)
+    ws_dst = open_worksheet(DST_SS_ID, DST_SHEET_NAME)
 
     # Очищаем колонки A, B, C, D полностью (до 50к строки)
     api_retry(ws_dst.batch_clear, ["A2:D50000"])
@@ -95,6 +169,8 @@ def main():
     )
 
     logging.info(f"✔ Данные в колонках A, B, C, D успешно обновлены")
+    remember("qa_rating_update", fingerprints)
+    return df
 
 if __name__ == "__main__":
     main()
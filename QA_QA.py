@@ -1,149 +1,149 @@
 #!/usr/bin/env python3
 import os
 import json
+import math
+import hashlib
 import logging
-import time
-import io
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 import requests
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from gspread_dataframe import set_with_dataframe
-from gspread.exceptions import APIError, WorksheetNotFound
-from gspread.utils import rowcol_to_a1
-from requests.exceptions import RequestException, ReadTimeout
+from gspread.exceptions import APIError
+from gspread.utils import rowcol_to_a1, absolute_range_name
+
+import api_metrics
+from sheets_client import api_retry, open_worksheet, fetch_all_values, open_csv_stream, values_batch_get
+from source_state import sources_changed, remember
 
 # —————————————————————————————
-SOURCE_SS_ID      = "1gV9STzFPKMeIkVO6MFILzC-v2O6cO3XZyi4sSstgd8A"
-SOURCE_SHEET_NAME = "All lesson reviews OLD"
-DEST_SS_ID        = "1rS8JfkaqxQ56cEhGzKd30XR4WxIC5ZsmkIqMEfTCzRI"
-DEST_SHEET_NAME   = "QA - Lesson evaluation"
+SOURCE_SS_ID       = "1gV9STzFPKMeIkVO6MFILzC-v2O6cO3XZyi4sSstgd8A"
+SOURCE_SHEET_NAME  = "All lesson reviews OLD"
+SOURCE2_SS_ID      = "1R8GzRVL58XxheG0FRtSRfE6Ib5E_GcZh1Ws_iaDOpbk"
+SOURCE2_SHEET_NAME = "QA Workspace Archive"
+SOURCE3_SS_ID      = "1R8GzRVL58XxheG0FRtSRfE6Ib5E_GcZh1Ws_iaDOpbk"
+SOURCE3_SHEET_NAME = "QA Workspace Graduation Archive"
+DEST_SS_ID         = "1rS8JfkaqxQ56cEhGzKd30XR4WxIC5ZsmkIqMEfTCzRI"
+DEST_SHEET_NAME    = "QA - Lesson evaluation"
 # —————————————————————————————
 
 # NEW — ключи дедупликации/приоритеты
 # None => дубликат = полное совпадение по всем колонкам
 DEDUPE_SUBSET = None
-DEDUPE_KEEP = "first"  # при конфликте оставляем первую
-SOURCE_PRIORITY = {"GRAD": 0, "ARCH": 1, "OLD": 2}  # GRAD > ARCH > OLD
+SOURCE_PRIORITY = {"GRAD": 0, "ARCH": 1, "OLD": 2}  # GRAD > ARCH > OLD, при конфликте остаётся первая
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+# Размер блока строк при потоковом разборе CSV-экспорта
+CSV_CHUNK_ROWS = 20_000
 
+# Хэши строк, уже записанных в целевой лист (в порядке строк), — чтобы дописывать только новые
+DEDUPE_INDEX_FILE = os.environ.get("QA_DEDUPE_INDEX_FILE", ".qa_qa_dedupe.json")
 
-def api_retry_open(client, key, max_attempts=5, backoff=1.0):
-    for i in range(1, max_attempts+1):
-        try:
-            logging.info(f"open_by_key attempt {i}/{max_attempts}")
-            return client.open_by_key(key)
-        except APIError as e:
-            code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and i < max_attempts:
-                logging.warning(f"open_by_key got {code}, retrying in {backoff:.1f}s")
-                time.sleep(backoff); backoff *= 2
-                continue
-            raise
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 
-def api_retry_worksheet(sh, title, max_attempts=5, backoff=1.0):
-    for i in range(1, max_attempts+1):
-        try:
-            logging.info(f"worksheet('{title}') attempt {i}/{max_attempts}")
-            return sh.worksheet(title)
-        except APIError as e:
-            code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and i < max_attempts:
-                logging.warning(f"worksheet got {code}, retrying in {backoff:.1f}s")
-                time.sleep(backoff); backoff *= 2
-                continue
-            raise
-        except WorksheetNotFound:
-            logging.error(f"Worksheet '{title}' not found")
-            raise
+def column_ranges(cols_idx):
+    ranges = []
+    for idx in cols_idx:
+        a1 = rowcol_to_a1(1, idx+1)
+        col = ''.join(filter(str.isalpha, a1))
+        ranges.append(f"{col}1:{col}")
+    return ranges
 
 
-def fetch_csv_with_retries(url: str, max_attempts=5, backoff=1.0) -> bytes:
-    delay = backoff
-    for i in range(1, max_attempts+1):
-        try:
-            logging.info(f"CSV fetch attempt {i}/{max_attempts}")
-            r = requests.get(url, timeout=(10, 120))
-            if r.status_code >= 500:
-                raise RequestException(f"{r.status_code} Server Error")
-            r.raise_for_status()
-            return r.content
-        except (RequestException, ReadTimeout) as e:
-            if i == max_attempts:
-                logging.error(f"CSV fetch failed after {i} attempts: {e}")
-                raise
-            logging.warning(f"CSV fetch error ({e}), retrying in {delay:.1f}s…")
-            time.sleep(delay); delay *= 2
-
-
-def fetch_all_values_with_retries(ws, max_attempts=5, backoff=1.0):
-    for i in range(1, max_attempts+1):
-        try:
-            logging.info(f"get_all_values() attempt {i}/{max_attempts}")
-            return ws.get_all_values()
-        except APIError as e:
-            code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and i < max_attemptments:
-                logging.warning(f"get_all_values got {code}, retrying in {backoff:.1f}s")
-                time.sleep(backoff); backoff *= 2
-                continue
-            logging.error(f"get_all_values failed: {e}")
-            raise
+def columns_to_frame(batch):
+    """Блоки колонок (строки вида [[v], [v], []…], первая — заголовок) -> DataFrame."""
+    cols = [[r[0] if r else "" for r in colblock] for colblock in batch]
+    headers = [c[0] if c else "" for c in cols]
+    data = list(zip(*(c[1:] for c in cols)))
+    return pd.DataFrame(data, columns=headers)
 
 
-def fetch_columns(ws, cols_idx, max_attempts=3, backoff=1.0):
+def fetch_columns(ws, cols_idx, max_attempts=3):
     """
     Пытаемся batch_get нужных колонок cols_idx (0-based).
     Если и он всё равно падает, выйдем с APIError и дадим main() обработать.
     """
-    backoff_local = backoff
-    for i in range(1, max_attempts+1):
-        try:
-            ranges = []
-            for idx in cols_idx:
-                a1 = rowcol_to_a1(1, idx+1)
-                col = ''.join(filter(str.isalpha, a1))
-                ranges.append(f"{col}1:{col}")
-            logging.info(f"batch_get ranges {ranges} (attempt {i}/{max_attempts})")
-            batch = ws.batch_get(ranges)
-            cols = [[r[0] if r else "" for r in colblock] for colblock in batch]
-            headers = [c[0] for c in cols]
-            data = list(zip(*(c[1:] for c in cols)))
-            return pd.DataFrame(data, columns=headers)
-        except APIError as e:
-            if i < max_attempts:
-                logging.warning(f"batch_get got {e}, retrying in {backoff_local:.1f}s")
-                time.sleep(backoff_local); backoff_local *= 2
-                continue
-            logging.error(f"batch_get failed after {i} attempts: {e}")
-            raise
+    ranges = column_ranges(cols_idx)
+    logging.info(f"batch_get ranges {ranges}")
+    batch = api_retry(ws.batch_get, ranges, max_attempts=max_attempts)
+    return columns_to_frame(batch)
 
 
-def get_selected_columns_from_sheet(client, ss_id, sheet_name, cols_to_take):
-    sh = api_retry_open(client, ss_id)
-    ws = api_retry_worksheet(sh, sheet_name)
+def plan_fetches(sources):
+    """
+    sources: [(tag, ss_id, sheet_name, cols_idx)].
+    Группирует диапазоны колонок по таблице: {ss_id: [(tag, sheet_name, cols_idx, ranges)]},
+    чтобы листы одной таблицы читались одним values.batchGet.
+    """
+    plan = {}
+    for tag, ss_id, sheet_name, cols_idx in sources:
+        ranges = [absolute_range_name(sheet_name, r) for r in column_ranges(cols_idx)]
+        plan.setdefault(ss_id, []).append((tag, sheet_name, cols_idx, ranges))
+    return plan
+
+
+def fetch_spreadsheet(ss_id, specs):
+    """
+    Один batchGet на таблицу для всех её листов; результат режем обратно по листам.
+    Если общий запрос не прошёл — каждый лист читаем по-старому, со своими fallback'ами.
+    """
+    ranges = [r for _, _, _, rs in specs for r in rs]
+    try:
+        value_ranges = values_batch_get(ss_id, ranges)
+        logging.info(f"→ batchGet {ss_id}: {len(specs)} лист(а), {len(ranges)} диапазонов")
+    except (APIError, requests.HTTPError) as e:
+        logging.warning(f"batchGet по {ss_id} не прошел ({e}), читаем листы по одному…")
+        return {tag: get_selected_columns_from_sheet(ss_id, sheet_name, cols_idx)
+                for tag, sheet_name, cols_idx, _ in specs}
+
+    out, pos = {}, 0
+    for tag, sheet_name, _, rs in specs:
+        batch = [vr.get("values", []) for vr in value_ranges[pos:pos + len(rs)]]
+        pos += len(rs)
+        out[tag] = columns_to_frame(batch)
+        logging.info(f"→ {sheet_name}: shape={out[tag].shape}")
+    return out
+
+
+def fetch_sources(sources):
+    """Читает все источники: по одному запросу на таблицу, таблицы — параллельно."""
+    plan = plan_fetches(sources)
+    frames = {}
+    with ThreadPoolExecutor(max_workers=len(plan) or 1) as pool:
+        for result in pool.map(api_metrics.bind_job(lambda item: fetch_spreadsheet(*item)), plan.items()):
+            frames.update(result)
+    return frames
+
+
+def read_csv_columns(url, cols_idx):
+    """
+    Читает из CSV-экспорта только колонки cols_idx (0-based), блоками по CSV_CHUNK_ROWS,
+    пока ответ ещё скачивается. Значения — строки как в листе, как и у batch_get.
+    """
+    with open_csv_stream(url) as stream:
+        chunks = pd.read_csv(stream, usecols=cols_idx, dtype=str, keep_default_na=False,
+                             encoding="utf-8", chunksize=CSV_CHUNK_ROWS)
+        df = pd.concat(list(chunks), ignore_index=True)
+    # usecols отдаёт колонки в порядке файла — возвращаем порядок cols_idx
+    order = sorted(cols_idx)
+    return df.iloc[:, [order.index(i) for i in cols_idx]]
+
+
+def get_selected_columns_from_sheet(ss_id, sheet_name, cols_to_take):
+    ws = open_worksheet(ss_id, sheet_name)
     try:
         df = fetch_columns(ws, cols_to_take)
         logging.info(f"→ batch_get succeeded for {sheet_name}, shape={df.shape}")
     except APIError:
         logging.warning("batch_get не прошел, пробуем CSV-экспорт…")
-        gid = ws.id
-        creds = client.auth
-        token = creds.get_access_token().access_token
-        export_url = (
-            f"https://docs.google.com/spreadsheets/d/{ss_id}/export"
-            f"?format=csv&gid={gid}&access_token={token}"
-        )
+        export_url = f"https://docs.google.com/spreadsheets/d/{ss_id}/export?format=csv&gid={ws.id}"
         try:
-            csv_bytes = fetch_csv_with_retries(export_url)
-            df_all = pd.read_csv(io.StringIO(csv_bytes.decode("utf-8")))
-            logging.info(f"→ CSV-экспорт удался, shape={df_all.shape}")
+            df = read_csv_columns(export_url, cols_to_take)
+            logging.info(f"→ CSV-экспорт удался, shape={df.shape}")
+            return df
         except Exception as e:
             logging.warning(f"CSV-экспорт упал ({e}), пробуем get_all_values()…")
-            all_vals = fetch_all_values_with_retries(ws)
+            all_vals = fetch_all_values(ws)
             if not all_vals or len(all_vals) < 2:
                 logging.error("Нет данных ни одним способом – выхожу.")
                 return None
@@ -154,29 +154,91 @@ def get_selected_columns_from_sheet(client, ss_id, sheet_name, cols_to_take):
     return df
 
 
+def normalize_cell(v):
+    if v is None or (isinstance(v, float) and math.isnan(v)):
+        return ""
+    return str(v).strip()
+
+
+def row_hash(values):
+    return hashlib.blake2b("\x1f".join(values).encode("utf-8"), digest_size=16).hexdigest()
+
+
+def stream_unique_rows(frames, key_idx, written=frozenset()):
+    """
+    Идём по источникам в порядке приоритета и оставляем первую строку для каждого ключа
+    (без общего concat/sort). Строки, чьи хэши уже есть в written, пропускаем.
+    Возвращает (новые нормализованные строки, их хэши).
+    """
+    seen = set()
+    rows, hashes = [], []
+    for df in frames:
+        for rec in df.itertuples(index=False, name=None):
+            row = [normalize_cell(v) for v in rec]
+            h = row_hash([row[i] for i in key_idx])
+            if h in seen:
+                continue
+            seen.add(h)
+            if h in written:
+                continue
+            rows.append(row)
+            hashes.append(h)
+    return rows, hashes
+
+
+def load_dedupe_index():
+    try:
+        with open(DEDUPE_INDEX_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_dedupe_index(hashes, key_idx, tail):
+    tmp = DEDUPE_INDEX_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"key_idx": key_idx, "hashes": hashes, "tail": tail}, f)
+    os.replace(tmp, DEDUPE_INDEX_FILE)
+
+
+def read_tail(ws_dst, last_row):
+    """
+    Хэш строки last_row так, как её отдаёт Sheets (FORMATTED_VALUE после USER_ENTERED),
+    или None, если строки нет или под ней что-то есть. Читаем только две строки.
+    """
+    tail = api_retry(ws_dst.get, f"A{last_row}:E{last_row + 1}")
+    if len(tail) != 1:
+        return None
+    return row_hash([normalize_cell(v) for v in tail[0]] + [""] * (5 - len(tail[0])))
+
+
+def index_matches_destination(ws_dst, index, key_idx):
+    """
+    Дешёвая проверка, что лист не меняли руками: последняя записанная нами строка
+    на своём месте, а под ней пусто. Сравниваем с хэшем, прочитанным сразу после записи:
+    Sheets показывает записанное не всегда тем же текстом ("007" -> "7", даты в формате листа).
+    """
+    if not index or not index.get("hashes") or not index.get("tail") or index.get("key_idx") != key_idx:
+        return False
+    return read_tail(ws_dst, 1 + len(index["hashes"])) == index["tail"]  # данные с A2
+
+
 def main():
-    # 1) Авторизация
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    sa_info = json.loads(os.environ["GCP_SERVICE_ACCOUNT"])
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(sa_info, scope)
-    client = gspread.authorize(creds)
-    logging.info("✔ Авторизованы в Google Sheets")
-
-    # 2) Тянем данные из первого источника
-    cols_to_take_1 = [2, 3, 14, 12, 5]  # C, D, O, M, F
-    df1 = get_selected_columns_from_sheet(client, SOURCE_SS_ID, SOURCE_SHEET_NAME, cols_to_take_1)
-
-    # 3) Тянем данные из второго источника
-    SOURCE2_SS_ID      = "1R8GzRVL58XxheG0FRtSRfE6Ib5E_GcZh1Ws_iaDOpbk"
-    SOURCE2_SHEET_NAME = "QA Workspace Archive"
-    cols_to_take_2 = [0, 1, 12, 10, 3]  # A, B, M, K, D
-    df2 = get_selected_columns_from_sheet(client, SOURCE2_SS_ID, SOURCE2_SHEET_NAME, cols_to_take_2)
-
-    # 3a) Тянем данные из третьего источника (новый лист!)
-    SOURCE3_SS_ID      = "1R8GzRVL58XxheG0FRtSRfE6Ib5E_GcZh1Ws_iaDOpbk"
-    SOURCE3_SHEET_NAME = "QA Workspace Graduation Archive"
-    cols_to_take_3 = [0, 1, 12, 11, 3]  # A, B, M, L, D
-    df3 = get_selected_columns_from_sheet(client, SOURCE3_SS_ID, SOURCE3_SHEET_NAME, cols_to_take_3)
+    # 0) Если источник не менялся с прошлого успешного запуска — ничего не делаем
+    changed, fingerprints = sources_changed("qa_qa", [SOURCE_SS_ID, SOURCE2_SS_ID, SOURCE3_SS_ID])
+    if not changed:
+        logging.info("✔ Источник не менялся, пропускаем запуск")
+        return None
+
+    # 1–2a) Тянем нужные колонки всех трёх источников
+    # (листы одной таблицы — одним batchGet, разные таблицы — параллельно)
+    sources = [
+        ("OLD",  SOURCE_SS_ID,  SOURCE_SHEET_NAME,  [2, 3, 14, 12, 5]),  # C, D, O, M, F
+        ("ARCH", SOURCE2_SS_ID, SOURCE2_SHEET_NAME, [0, 1, 12, 10, 3]),  # A, B, M, K, D
+        ("GRAD", SOURCE3_SS_ID, SOURCE3_SHEET_NAME, [0, 1, 12, 11, 3]),  # A, B, M, L, D (новый лист!)
+    ]
+    by_src = fetch_sources(sources)
+    df1, df2, df3 = by_src["OLD"], by_src["ARCH"], by_src["GRAD"]
 
     # NEW — приводим названия колонок и помечаем источник (для приоритета при дедупе)
     TARGET_COLUMNS = list(df1.columns) if df1 is not None else ['Col1', 'Col2', 'Col3', 'Col4', 'Col5']
@@ -185,52 +247,49 @@ def main():
     if df3 is not None:
         df3.columns = TARGET_COLUMNS
 
-    if df1 is not None:
-        df1["_src"] = "OLD"
-    if df2 is not None:
-        df2["_src"] = "ARCH"
-    if df3 is not None:
-        df3["_src"] = "GRAD"
-
-    # NEW — лёгкая нормализация строк (убираем лишние пробелы, чтобы не плодили псевдодубли)
-    for d in (df1, df2, df3):
-        if d is not None:
-            obj_cols = d.select_dtypes(include="object").columns
-            d[obj_cols] = d[obj_cols].apply(lambda s: s.str.strip())
-
-    # 4) Объединяем (как раньше, но с проверками)
+    # 3) Проверки (как раньше)
     if all(x is None for x in [df1, df2, df3]):
         logging.error("❌ Не удалось получить новые данные ни из одного источника. Старая таблица останется без изменений.")
         return
 
-    dfs = [d for d in [df1, df2, df3] if d is not None and not d.empty]
-    if not dfs:
+    frames = [by_src[src] for src in sorted(by_src, key=SOURCE_PRIORITY.get)
+              if by_src[src] is not None and not by_src[src].empty]
+    if not frames:
         logging.error("❌ Нет данных для записи.")
         return
 
-    df = pd.concat(dfs, ignore_index=True)
-
-    # NEW — сортируем по приоритету источника → при drop_duplicates останется «лучшая» версия
-    df["_prio"] = df["_src"].map(SOURCE_PRIORITY).fillna(9)
-    df = df.sort_values("_prio", kind="stable")
-
-    # NEW — дедупликация
+    # NEW — потоковая дедупликация по хэшу нормализованной строки (strip, пустые = "")
     subset = TARGET_COLUMNS if DEDUPE_SUBSET is None else DEDUPE_SUBSET
-    before = len(df)
-    df = df.drop_duplicates(subset=subset, keep=DEDUPE_KEEP, ignore_index=True)
-    after = len(df)
-    logging.info(f"✔ Дедупликация: {before} → {after} строк (ключ: {subset})")
-
-    # NEW — чистим служебные колонки и порядок столбцов
-    df = df.drop(columns=["_src", "_prio"], errors="ignore")
-    df = df[TARGET_COLUMNS]
-
-    # 5) Запись в целевой лист (как было)
-    sh_dst = api_retry_open(client, DEST_SS_ID)
-    ws_dst = api_retry_worksheet(sh_dst, DEST_SHEET_NAME)
-    ws_dst.batch_clear(["A2:E"])
-    set_with_dataframe(ws_dst, df, row=2, col=1, include_index=False, include_column_header=False)
-    logging.info(f"✔ Данные записаны в «{DEST_SHEET_NAME}» — {df.shape[0]} строк")
+    key_idx = [TARGET_COLUMNS.index(c) for c in subset]
+
+    ws_dst = open_worksheet(DEST_SS_ID, DEST_SHEET_NAME)
+    index = load_dedupe_index()
+    incremental = os.environ.get("FORCE_SYNC") != "1" and index_matches_destination(ws_dst, index, key_idx)
+    written = set(index["hashes"]) if incremental else frozenset()
+
+    rows, hashes = stream_unique_rows(frames, key_idx, written)
+    df = pd.DataFrame(rows, columns=TARGET_COLUMNS)
+    total = sum(len(d) for d in frames)
+
+    # 4) Запись в целевой лист
+    if incremental:
+        logging.info(f"✔ Дедупликация: {total} строк источников, новых {len(rows)} (ключ: {subset})")
+        if rows:
+            start_row = 2 + len(index["hashes"])
+            api_retry(set_with_dataframe, ws_dst, df, row=start_row, col=1,
+                      include_index=False, include_column_header=False)
+            logging.info(f"✔ Дописано в «{DEST_SHEET_NAME}» — {len(rows)} строк с A{start_row}")
+        hashes = index["hashes"] + hashes
+        tail = read_tail(ws_dst, 1 + len(hashes)) if rows else index["tail"]
+        save_dedupe_index(hashes, key_idx, tail)
+    else:
+        logging.info(f"✔ Дедупликация: {total} → {len(rows)} строк (ключ: {subset}), полная перезапись")
+        api_retry(ws_dst.batch_clear, ["A2:E"])
+        api_retry(set_with_dataframe, ws_dst, df, row=2, col=1, include_index=False, include_column_header=False)
+        logging.info(f"✔ Данные записаны в «{DEST_SHEET_NAME}» — {df.shape[0]} строк")
+        save_dedupe_index(hashes, key_idx, read_tail(ws_dst, 1 + len(hashes)) if hashes else None)
+    remember("qa_qa", fingerprints)
+    return df
 
 
 if __name__ == "__main__":
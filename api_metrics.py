@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Учёт каждого обращения к Google API: эндпоинт, диапазон, задержка, байты,
+повторы, паузы backoff и ошибки квоты (429).
+
+Счётчики агрегируются в памяти (словарь на ключ, без списка всех вызовов),
+поэтому слой дешёвый и стоит на горячем пути:
+- в скриптах — InstrumentedAdapter на общей сессии sheets_client (видит и gspread);
+- в дашборде — observed_get вокруг requests.get;
+- повторы и backoff сообщают api_retry обеих реализаций.
+
+По завершении процесса (или явным write_reports) пишутся
+API_METRICS_DIR/<run>.json — сводка (с точными диапазонами) и <run>.prom —
+textfile для node_exporter. Метки job — имя джобы (set_job в пайплайне),
+run — имя процесса, sheet — имя листа (без номеров строк).
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import threading
+import contextvars
+from collections import defaultdict
+from urllib.parse import urlsplit, parse_qs, unquote
+
+from requests.adapters import HTTPAdapter
+
+METRICS_DIR = os.environ.get("API_METRICS_DIR", ".metrics")
+ENABLED = os.environ.get("API_METRICS", "1") != "0"
+SHEET_LABEL_CHARS = 64  # предел метки sheet в .prom; точные диапазоны — только в JSON
+
+_lock = threading.Lock()
+_job = contextvars.ContextVar("api_metrics_job", default=None)
+_outer = contextvars.ContextVar("api_metrics_outer", default=False)  # вызов уже замеряет observed_get
+_started = time.time()
+# request_bytes — тело запроса (от нас к API), response_bytes — тело ответа
+_calls = defaultdict(lambda: {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "response_bytes": 0, "request_bytes": 0,
+                              "quota_errors": 0, "errors": 0})
+_retries = defaultdict(lambda: {"retries": 0, "backoff_seconds": 0.0})
+_reported = False
+
+
+def run_name():
+    return os.environ.get("API_METRICS_RUN") or os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python"
+
+
+# === Метка джобы ===
+def set_job(name):
+    """Метка job для вызовов из текущего потока (пайплайн ставит её в run_node)."""
+    _job.set(name)
+
+
+def current_job():
+    return _job.get() or run_name()
+
+
+def bind_job(fn):
+    """Оборачивает fn для пула потоков так, чтобы вызовы внутри шли под меткой вызывающей джобы."""
+    job = _job.get()
+
+    def run(*args, **kwargs):
+        token = _job.set(job)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _job.reset(token)
+    return run
+
+
+# === Классификация запросов ===
+def classify(method, url):
+    """-> (endpoint, range) по URL Google API."""
+    parts = urlsplit(url)
+    path = unquote(parts.path)
+    query = parse_qs(parts.query)
+    host = parts.netloc
+    # по пути, а не по хосту: на локальном стенде (fake_sheets) хост подменён
+    if path.endswith("/export"):
+        return "export.csv", f"gid={query.get('gid', ['?'])[0]}"
+    if "/drive/v3/files/" in path:
+        return "drive.files.get", "-"
+    if "/v4/spreadsheets/" not in path:
+        return f"{method.lower()} {host}", "-"
+    tail = path.split("/v4/spreadsheets/", 1)[1]
+    ss_id, _, rest = tail.partition("/")
+    if not rest:
+        return ("spreadsheets.batchUpdate" if ss_id.endswith(":batchUpdate") else "spreadsheets.get"), "-"
+    if rest.startswith("sheets/"):
+        return "sheets.copyTo", "-"
+    if rest.startswith("values:"):
+        endpoint = "values." + rest.split(":", 1)[1]
+        return endpoint, ",".join(query.get("ranges", [])) or "-"
+    if rest.startswith("values/"):
+        rng = rest[len("values/"):]
+        if rng.endswith(":clear"):
+            return "values.clear", rng[:-len(":clear")]
+        if rng.endswith(":append"):
+            return "values.append", rng[:-len(":append")]
+        return ("values.get" if method == "GET" else "values.update"), rng
+    return f"{method.lower()} sheets", "-"
+
+
+# === Запись ===
+def record_call(method, url, status, seconds, request_bytes=0, response_bytes=0):
+    if not ENABLED:
+        return
+    endpoint, rng = classify(method, url)
+    key = (current_job(), endpoint, rng)
+    with _lock:
+        c = _calls[key]
+        c["calls"] += 1
+        c["seconds"] += seconds
+        c["max_seconds"] = max(c["max_seconds"], seconds)
+        c["request_bytes"] += request_bytes
+        c["response_bytes"] += response_bytes
+        if status == 429:
+            c["quota_errors"] += 1
+        elif status is None or status >= 400:
+            c["errors"] += 1
+    _ensure_atexit()
+
+
+def record_retry(call, delay):
+    if not ENABLED:
+        return
+    with _lock:
+        r = _retries[(current_job(), call)]
+        r["retries"] += 1
+        r["backoff_seconds"] += delay
+
+
+def _body_len(body):
+    if body is None:
+        return 0
+    return len(body) if isinstance(body, (bytes, str)) else 0
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """HTTPAdapter, который замеряет каждый запрос (время до полного ответа, байты в обе стороны)."""
+
+    def send(self, request, stream=False, **kwargs):
+        if _outer.get():
+            return super().send(request, stream=stream, **kwargs)
+        start = time.perf_counter()
+        try:
+            resp = super().send(request, stream=stream, **kwargs)
+        except Exception:
+            record_call(request.method, request.url, None, time.perf_counter() - start, _body_len(request.body))
+            raise
+        if stream:
+            # тело читается потоком позже — берём размер из заголовка, если он есть
+            size = int(resp.headers.get("Content-Length") or 0)
+        else:
+            size = len(resp.content)
+        record_call(request.method, request.url, resp.status_code, time.perf_counter() - start,
+                    _body_len(request.body), size)
+        return resp
+
+
+def observed_get(url, **kwargs):
+    """requests.get с учётом в метриках (для кода, который не ходит через общую сессию)."""
+    import requests
+    start = time.perf_counter()
+    token = _outer.set(True)
+    try:
+        resp = requests.get(url, **kwargs)
+    except Exception:
+        record_call("GET", url, None, time.perf_counter() - start)
+        raise
+    finally:
+        _outer.reset(token)
+    record_call("GET", resp.url or url, resp.status_code, time.perf_counter() - start, 0, len(resp.content))
+    return resp
+
+
+# === Отчёты ===
+def summary():
+    with _lock:
+        calls = {k: dict(v) for k, v in _calls.items()}
+        retries = {k: dict(v) for k, v in _retries.items()}
+    totals = {"calls": 0, "seconds": 0.0, "response_bytes": 0, "request_bytes": 0, "quota_errors": 0, "errors": 0,
+              "retries": sum(r["retries"] for r in retries.values()),
+              "backoff_seconds": round(sum(r["backoff_seconds"] for r in retries.values()), 3)}
+    by_endpoint = defaultdict(lambda: defaultdict(float))
+    for (job, endpoint, _), c in calls.items():
+        for field in ("calls", "seconds", "response_bytes", "request_bytes", "quota_errors", "errors"):
+            totals[field] += c[field]
+            by_endpoint[(job, endpoint)][field] += c[field]
+    totals["seconds"] = round(totals["seconds"], 3)
+    return {
+        "run": run_name(),
+        "started": _started,
+        "finished": time.time(),
+        "totals": totals,
+        "by_endpoint": [
+            {"job": job, "endpoint": endpoint, **{k: (round(v, 3) if k == "seconds" else int(v)) for k, v in c.items()}}
+            for (job, endpoint), c in sorted(by_endpoint.items())
+        ],
+        "by_range": sorted(
+            ({"job": job, "endpoint": endpoint, "range": rng, **c} for (job, endpoint, rng), c in calls.items()),
+            key=lambda r: (-r["seconds"], r["job"]),
+        ),
+        "retries": [{"job": job, "call": call, **r} for (job, call), r in sorted(retries.items())],
+    }
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def sheet_label(rng):
+    """
+    Диапазон(ы) -> имена листов для метки Prometheus: 'groups'!A4:D52,'groups'!A60:D233 -> groups.
+    Номера строк зависят от данных, и с ними каждый прогон плодил бы новые серии.
+    """
+    if rng == "-" or rng.startswith("gid="):
+        return rng
+    sheets = []
+    for part in rng.split(","):
+        name = part.rsplit("!", 1)[0] if "!" in part else part
+        if name.startswith("'") and name.endswith("'"):
+            name = name[1:-1].replace("''", "'")
+        if name not in sheets:
+            sheets.append(name)
+    label = ",".join(sheets)
+    return label if len(label) <= SHEET_LABEL_CHARS else label[:SHEET_LABEL_CHARS - 1] + "…"
+
+
+def _by_sheet(ranges):
+    """Строки by_range, сведённые по (job, endpoint, sheet)."""
+    out = {}
+    for r in ranges:
+        key = (r["job"], r["endpoint"], sheet_label(r["range"]))
+        agg = out.setdefault(key, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "response_bytes": 0, "request_bytes": 0})
+        for field in ("calls", "seconds", "response_bytes", "request_bytes"):
+            agg[field] += r[field]
+        agg["max_seconds"] = max(agg["max_seconds"], r["max_seconds"])
+    return [{"job": job, "endpoint": endpoint, "sheet": sheet, **agg} for (job, endpoint, sheet), agg in sorted(out.items())]
+
+
+def prometheus_text(data):
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            label_str = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_str}}} {value}")
+
+    run = data["run"]
+    ranges = _by_sheet(data["by_range"])
+    metric("sheets_api_calls_total", "counter", "Google API calls", [
+        ({"run": run, "job": r["job"], "endpoint": r["endpoint"], "sheet": r["sheet"]}, r["calls"]) for r in ranges])
+    metric("sheets_api_latency_seconds_total", "counter", "Time spent waiting for Google API responses", [
+        ({"run": run, "job": r["job"], "endpoint": r["endpoint"], "sheet": r["sheet"]}, round(r["seconds"], 6)) for r in ranges])
+    metric("sheets_api_latency_seconds_max", "gauge", "Slowest single call", [
+        ({"run": run, "job": r["job"], "endpoint": r["endpoint"], "sheet": r["sheet"]}, round(r["max_seconds"], 6)) for r in ranges])
+    metric("sheets_api_response_bytes_total", "counter", "Response body bytes", [
+        ({"run": run, "job": r["job"], "endpoint": r["endpoint"], "sheet": r["sheet"]}, r["response_bytes"]) for r in ranges])
+    metric("sheets_api_request_bytes_total", "counter", "Request body bytes", [
+        ({"run": run, "job": r["job"], "endpoint": r["endpoint"], "sheet": r["sheet"]}, r["request_bytes"]) for r in ranges])
+    metric("sheets_api_quota_errors_total", "counter", "HTTP 429 responses", [
+        ({"run": run, "job": e["job"], "endpoint": e["endpoint"]}, e["quota_errors"]) for e in data["by_endpoint"]])
+    metric("sheets_api_errors_total", "counter", "Other failed calls (4xx/5xx/network)", [
+        ({"run": run, "job": e["job"], "endpoint": e["endpoint"]}, e["errors"]) for e in data["by_endpoint"]])
+    metric("sheets_api_retries_total", "counter", "Retries made by api_retry", [
+        ({"run": run, "job": r["job"], "call": r["call"]}, r["retries"]) for r in data["retries"]])
+    metric("sheets_api_backoff_seconds_total", "counter", "Time slept between retries", [
+        ({"run": run, "job": r["job"], "call": r["call"]}, round(r["backoff_seconds"], 6)) for r in data["retries"]])
+    metric("sheets_api_run_finished_timestamp_seconds", "gauge", "When this report was written", [
+        ({"run": run}, round(data["finished"], 3))])
+    return "\n".join(lines) + "\n"
+
+
+def write_reports(run=None):
+    """Пишет <run>.json и <run>.prom в METRICS_DIR (атомарно). Возвращает сводку."""
+    data = summary()
+    if run:
+        data["run"] = run
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    for ext, text in (("json", json.dumps(data, indent=2)), ("prom", prometheus_text(data))):
+        path = os.path.join(METRICS_DIR, f"{data['run']}.{ext}")
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+    return data
+
+
+def _report_at_exit():
+    if not ENABLED:  # выключили по ходу процесса (например, каталог отчётов уже удалён)
+        return
+    try:
+        data = write_reports()
+        t = data["totals"]
+        print(f"API metrics: {t['calls']} calls, {t['seconds']:.1f}s, {t['response_bytes'] / 2**20:.1f} MB in responses, "
+              f"{t['retries']} retries, {t['quota_errors']} quota errors -> {METRICS_DIR}/{data['run']}.json",
+              file=sys.stderr)
+    except OSError:
+        pass
+
+
+def _ensure_atexit():
+    global _reported
+    if not _reported:
+        with _lock:
+            if not _reported:
+                atexit.register(_report_at_exit)
+                _reported = True
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк всех джоб на локальном стенде fake_sheets — без ключей и реальных таблиц.
+
+Поднимает FakeSheets, засевает таблицы синтетическими данными (--rows строк на
+лист-источник), направляет sheets_client на стенд и по очереди запускает
+main() каждого узла пайплайна и сборку дашборда (build_df через AppTest).
+По каждому — время, число API-вызовов по типам и переданные байты.
+Для части джоб результат ещё и сверяется с источником (CHECKS): например,
+QA-rating-update в обоих режимах ("copy" и "values") должен дать в A:D
+приёмника колонки A, B, O, L листа Lessons.
+
+    python benchmark.py --rows 5000
+    python benchmark.py --rows 5000 --latency 0.05 --quota 0.02
+    python benchmark.py --json bench.json
+    python benchmark.py --baseline bench.json      # exit 1, если хуже базы
+
+Состояние джоб (отпечатки, индексы, отметки) пишется во временный каталог,
+FORCE_SYNC=1 — каждая джоба делает полную работу. Клиентские метрики
+(api_metrics) по джобам — там же, в metrics/benchmark.json и .prom. Каталог
+удаляется после запуска, если не заданы --json или -v.
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import shutil
+import tempfile
+import importlib
+import traceback
+from unittest import mock
+
+import api_metrics
+import sheets_client
+from fake_sheets import FakeSheets, formatted
+from pipeline import NODES, topo_order
+
+# Насколько можно превысить базу (доля), прежде чем считать это регрессией
+TIME_TOLERANCE = 0.25
+COUNT_TOLERANCE = 0.0
+BYTES_TOLERANCE = 0.10
+
+DASHBOARD_FILE = "streamlit_qa_dashboard.py"
+# Что QA-rating-update обязан перенести: колонки Lessons A, B, O, L (0-based) -> A:D приёмника.
+# Задано здесь, а не берётся из COLUMN_MAP скрипта, чтобы ошибка в нём не проходила проверку.
+RATING_COLUMNS = [0, 1, 14, 11]
+
+
+# === Засев таблиц ===
+def seed_books(fake, rows=2000, seed=0):
+    """Таблицы и листы, которые читают и пишут джобы и дашборд, с правдоподобными данными."""
+    rng = random.Random(seed)
+    tutors = [f"{1000 + i}" for i in range(max(20, rows // 25))]
+    groups = [f"{c}-{n:03d}" for c in ("COL", "ESP", "CHI", "BRA", "MEX", "PER", "ARG") for n in range(40)]
+    markers = ["Excellent", "Good", "Needs work", ""]
+
+    def date(fmt="%Y-%m-%d"):
+        return time.strftime(fmt, time.gmtime(1_704_067_200 + rng.randrange(365) * 86400))
+
+    def review_row(width):
+        row = [f"cell{rng.randrange(10_000)}" for _ in range(width)]
+        row[0], row[1] = rng.choice(tutors), f"student{rng.randrange(rows)}"
+        return row
+
+    def book(ss_id):
+        return fake.add_book(ss_id)
+
+    # update_lessons: пары строк "Tutor" + данные, в двух листах
+    src = book("1gk6AV3sKtrMVG8Oxyzf2cODv_vmAIThiX5cHCVxSNjE")
+    for title in ("QA Workspace", "QA Workspace Graduations"):
+        grid = []
+        for _ in range(rows // 2):
+            grid.append(["Tutor"] + [f"h{i}" for i in range(14)])
+            grid.append([rng.choice(tutors), f"student{rng.randrange(rows)}"] + [str(rng.randrange(100)) for _ in range(13)])
+        src.add_sheet(title, grid, rows=len(grid) + 10, cols=15)
+    book("1njy8V5lyG3vyENr1b50qGd3infU4VHYP4CfaD0H1AlM").add_sheet(
+        "Lessons", [[f"H{i}" for i in range(15)]], rows=rows + 10, cols=15)
+
+    # QA-оценки: лист дашборда / приёмник QA-rating-update и рейтинги
+    for ss_id in ("1HItT2-PtZWoldYKL210hCQOLg3rh6U1Qj6NWkBjDjzk", "16QrbLtzLTV6GqyT8HYwzcwYIsXewzjUbM0Jy5i1fENE"):
+        b = book(ss_id)
+        qa = [["Lesson", "Date", "Score", "Marker", "", "", "Tutor ID"]]
+        qa += [[f"L{i}", date("%d/%m/%Y"), str(rng.randrange(50, 101)), rng.choice(markers), "", "", rng.choice(tutors)]
+               for i in range(rows // 2)]
+        b.add_sheet("QA - Lesson evaluation", qa, rows=rows + 10, cols=10)
+        rating = [["Tutor ID", "Rating w retention", "Num of QA scores", "Num of QA scores (last 90 days)",
+                   "Average QA score", "Average QA score (last 2 scores within last 90 days)",
+                   "Average QA marker", "Average QA marker (last 2 markers within last 90 days)"]]
+        rating += [[t, f"{rng.uniform(3, 5):.2f}", str(rng.randrange(30)), str(rng.randrange(10)),
+                    f"{rng.uniform(50, 100):.1f}", f"{rng.uniform(50, 100):.1f}",
+                    rng.choice(markers), rng.choice(markers)] for t in tutors]
+        b.add_sheet("Rating", rating, cols=10)
+
+    # QA_QA: три источника-архива (два в одной таблице) и приёмник
+    reviews = book("1gV9STzFPKMeIkVO6MFILzC-v2O6cO3XZyi4sSstgd8A")
+    reviews.add_sheet("All lesson reviews OLD", [[f"old{i}" for i in range(16)]] + [review_row(16) for _ in range(rows)])
+    reviews.add_sheet("All lesson reviews NEW", [[f"new{i}" for i in range(20)]] + [review_row(20) for _ in range(rows)])
+    archive = book("1R8GzRVL58XxheG0FRtSRfE6Ib5E_GcZh1Ws_iaDOpbk")
+    archive.add_sheet("QA Workspace Archive", [[f"arch{i}" for i in range(14)]] + [review_row(14) for _ in range(rows)])
+    archive.add_sheet("QA Workspace Graduation Archive", [[f"grad{i}" for i in range(14)]] + [review_row(14) for _ in range(rows // 2)])
+    dest = book("1rS8JfkaqxQ56cEhGzKd30XR4WxIC5ZsmkIqMEfTCzRI")
+    dest.add_sheet("QA - Lesson evaluation", [["Tutor", "Student", "Mark", "Score", "Date"]], rows=10, cols=5)
+    dest.add_sheet("Tutors", [["header row"]], rows=10, cols=10)
+
+    # update_tutors_QA: широкий лист до BH
+    tutors_book = book("1xqGCXsebSmYL4bqAwvTmD9lOentI45CTMxhea-ZDFls")
+    tutors_book.add_sheet("Tutors", [[f"col{i}" for i in range(60)]] +
+                          [[t] + [f"v{rng.randrange(1000)}" for _ in range(59)] for t in tutors for _ in range(5)])
+
+    # Уроки (публичные CSV дашборда, lessons_for_analytics) и группы
+    lessons = book("1_S-NyaVKuOc0xK12PBAYvdIauDBq9mdqHlnKLfSYNAE")
+    header = ["teacher_name", "teacher_id", "lesson_date", "group_title", "course_id",
+              "lesson_module", "lesson_number", "watch_url", "start_date", "lesson_time"]
+    for title, gid in (("lessons LATAM", 0), ("lessons Brazil", 835553195)):
+        grid = [header] + [[f"Tutor {t}", t, date(), rng.choice(groups), f"C{rng.randrange(20)}",
+                            f"M{rng.randrange(8)}", str(rng.randrange(1, 33)), f"https://example.com/{i}",
+                            date(), f"{rng.randrange(8, 21):02d}:{rng.choice(('00', '30'))}:00"]
+                           for i, t in enumerate(rng.choice(tutors) for _ in range(rows))]
+        lessons.add_sheet(title, grid, sheet_id=gid)
+    lessons.add_sheet("groups", [["id", "group", "course", "start"]] +
+                      [[str(i), rng.choice(groups), f"C{rng.randrange(20)}", date()] for i in range(rows)])
+
+    analytics = book("1yJmskKLGinBNKIV3ewXsVEfnh-JRj_FhuKyElL93vM4")
+    analytics.add_sheet("data", rows=10, cols=5)
+    analytics.add_sheet("group data", rows=10, cols=5)
+    sources = book("1LF2NrAm8J3c43wOoumtsyfQsX1z0_lUQVdByGSPe27U")
+    sources.add_sheet("Lessons source", rows=10, cols=5)
+    sources.add_sheet("Replacement", [["", "", "", "Date", "", "Group"]] +
+                      [["", "", "", date(), "", rng.choice(groups)] for _ in range(rows // 10)])
+    return fake
+
+
+# === Запуск ===
+def run_entry(fake, name, func):
+    fake.reset_stats()
+    api_metrics.set_job(name)
+    start = time.perf_counter()
+    status, error = "ok", None
+    try:
+        func()
+        problem = CHECKS[name](fake) if name in CHECKS else None
+        if problem:
+            status, error = "failed", f"check: {problem}"
+    except Exception as e:
+        status, error = "failed", f"{type(e).__name__}: {e}"
+        logging.debug(traceback.format_exc())
+    result = {"name": name, "status": status, "seconds": round(time.perf_counter() - start, 3)}
+    result.update(fake.snapshot_stats())
+    if error:
+        result["error"] = error
+    return result
+
+
+def job_entries(fake):
+    """(имя, вызов) для каждого узла пайплайна в топологическом порядке; результат верхнего узла не передаём."""
+    entries = []
+    for name in topo_order(NODES):
+        module_name = NODES[name][0]
+        entries.append((name, lambda m=module_name: importlib.import_module(m).main()))
+        if name == "qa_rating_update":
+            entries.append(rating_values_entry(fake, module_name))
+    return entries
+
+
+def rating_values_entry(fake, module_name):
+    """QA-rating-update в режиме "values" (чтение + запись) — после серверного копирования, на чистом A:D."""
+    def run():
+        mod = importlib.import_module(module_name)
+        dst = fake.book(mod.DST_SS_ID).by_title(mod.DST_SHEET_NAME)
+        for r in range(1, len(dst.grid)):
+            for c in range(len(mod.COLUMN_MAP)):
+                dst.set_cell(r, c, "")
+        with mock.patch.object(mod, "TRANSFER_MODE", "values"):
+            mod.main()
+    return "qa_rating_update[values]", run
+
+
+# === Проверки результата ===
+def check_rating_transfer(fake):
+    """A:D приёмника QA-rating-update == колонки A, B, O, L листа Lessons (со 2-й строки)."""
+    mod = importlib.import_module(NODES["qa_rating_update"][0])
+    src = fake.book(mod.SRC_SS_ID).by_title(mod.SRC_SHEET_NAME)
+    dst = fake.book(mod.DST_SS_ID).by_title(mod.DST_SHEET_NAME)
+    n_rows = max(len(src.grid), len(dst.grid))
+    # formatted: "values" пишет USER_ENTERED (числа становятся числами), copyPaste переносит как есть
+    expected = [[formatted(src.cell(r, c)) for c in RATING_COLUMNS] for r in range(1, n_rows)]
+    got = [[formatted(dst.cell(r, c)) for c in range(len(RATING_COLUMNS))] for r in range(1, n_rows)]
+    if not any(any(row) for row in expected):
+        return "source Lessons is empty"
+    for i, (want, have) in enumerate(zip(expected, got)):
+        if want != have:
+            return f"destination A:D row {i + 2} is {have}, Lessons A, B, O, L give {want}"
+    return None
+
+
+# имя записи -> проверка после успешного запуска (None — всё верно, иначе описание расхождения)
+CHECKS = {
+    "qa_rating_update": check_rating_transfer,
+    "qa_rating_update[values]": check_rating_transfer,
+}
+
+
+def dashboard_entry(fake, workdir):
+    """Сборка кадра дашборда (build_df) через AppTest; None, если streamlit не установлен."""
+    try:
+        from streamlit.testing.v1 import AppTest
+        import google.oauth2.service_account as service_account
+        import requests
+    except ImportError:
+        return None
+
+    class StaticCreds:
+        valid, token = True, "fake-token"
+
+        def refresh(self, request):
+            pass
+
+    session = fake.session()
+
+    def run():
+        env = {"GCP_SERVICE_ACCOUNT": "{}", "SNAPSHOT_DIR": os.path.join(workdir, "snapshots"),
+               "REFRESH_INTERVAL": "86400"}
+        with mock.patch.dict(os.environ, env), \
+                mock.patch.object(requests, "get", session.get), \
+                mock.patch.object(service_account.Credentials, "from_service_account_info",
+                                  lambda *a, **k: StaticCreds()):
+            at = AppTest.from_file(DASHBOARD_FILE, default_timeout=600)
+            at.session_state["auth_ok"] = True
+            at.run()
+            if at.exception:
+                raise RuntimeError(at.exception[0].message)
+
+    return "dashboard_build_df", run
+
+
+def compare(results, baseline):
+    """Строки с регрессиями относительно базы (время, число вызовов, байты)."""
+    base = {r["name"]: r for r in baseline}
+    problems = []
+    for r in results:
+        b = base.get(r["name"])
+        if not b:
+            continue
+        if r["status"] != "ok" and b["status"] == "ok":
+            problems.append(f"{r['name']}: now {r['status']}")
+        checks = [("seconds", TIME_TOLERANCE), ("total_calls", COUNT_TOLERANCE),
+                  ("bytes_out", BYTES_TOLERANCE), ("bytes_in", BYTES_TOLERANCE)]
+        for key, tol in checks:
+            if b.get(key) and r[key] > b[key] * (1 + tol):
+                problems.append(f"{r['name']}: {key} {b[key]} -> {r[key]}")
+    return problems
+
+
+def print_table(results):
+    print(f"{'entry':<24} {'status':<7} {'sec':>8} {'calls':>6} {'MB out':>8} {'MB in':>8} {'inj.err':>7}")
+    for r in results:
+        print(f"{r['name']:<24} {r['status']:<7} {r['seconds']:>8.2f} {r['total_calls']:>6} "
+              f"{r['bytes_out'] / 2**20:>8.2f} {r['bytes_in'] / 2**20:>8.2f} {r['errors_injected']:>7}")
+        if r.get("error"):
+            print(f"    ↳ {r['error']}")
+        print("    " + ", ".join(f"{k}={v}" for k, v in sorted(r["calls"].items())))
+
+
+def run_all(args, workdir):
+    """Стенд, засев и все записи по очереди; состояние джоб и метрики — в workdir."""
+    os.environ.update({
+        "FORCE_SYNC": "1",
+        "SHEETS_STATE_FILE": os.path.join(workdir, "sheets_state.json"),
+        "QA_DEDUPE_INDEX_FILE": os.path.join(workdir, "qa_qa_dedupe.json"),
+        "EVAL_HWM_FILE": os.path.join(workdir, "evaluation_hwm.json"),
+        "BULK_WRITE_STATE_FILE": os.path.join(workdir, "bulk_write_state.json"),
+        "LESSONS_RENDER_FILE": os.path.join(workdir, "update_lessons_render.json"),
+    })
+    api_metrics.METRICS_DIR = os.path.join(workdir, "metrics")
+
+    fake = FakeSheets(args.latency, args.errors, args.quota, seed=args.seed)
+    seed_books(fake, args.rows, args.seed)
+    fake.start()
+    sheets_client.use_session(fake.session())
+
+    entries = job_entries(fake)
+    dash = dashboard_entry(fake, workdir)
+    if dash:
+        entries.append(dash)
+    if args.only:
+        entries = [e for e in entries if e[0] in args.only]
+
+    # джобы логируют через basicConfig при импорте — оставляем только наш уровень
+    results = [run_entry(fake, name, func) for name, func in entries]
+    logging.getLogger().setLevel(logging.WARNING)
+    fake.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every job against the local fake Sheets server")
+    parser.add_argument("--rows", type=int, default=2000, help="rows per seeded source sheet")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--errors", type=float, default=0.0, help="share of requests failing with 503")
+    parser.add_argument("--quota", type=float, default=0.0, help="share of requests failing with 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", help="entries to run (pipeline node names, dashboard_build_df)")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare with results saved by --json; exit 1 on regression")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s", force=True)
+
+    # каталог состояния оставляем, только если он может понадобиться после запуска
+    keep = bool(args.json or args.verbose)
+    workdir = tempfile.mkdtemp(prefix="sheets-bench-")
+    try:
+        results = run_all(args, workdir)
+    finally:
+        if keep:
+            print(f"Job state, snapshots and API metrics: {workdir}")
+        else:
+            api_metrics.ENABLED = False  # отчёт при выходе писать уже некуда
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"rows": args.rows, "results": results}, f, indent=2)
+
+    failed = [r["name"] for r in results if r["status"] != "ok"]
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(results, json.load(f)["results"])
+        for p in problems:
+            print(f"❌ regression: {p}")
+        if problems:
+            sys.exit(1)
+    if failed:
+        print(f"❌ failed: {failed}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Блочная запись больших таблиц в лист.
+
+Вместо одного огромного update значения режутся на блоки строк, ограниченные
+по размеру (MAX_BLOCK_BYTES / MAX_BLOCK_ROWS), и блоки пишутся параллельно
+(WRITE_WORKERS потоков, каждый блок — через api_retry, т.е. с учётом 429).
+
+Блоки, упавшие и после api_retry на временной ошибке (429, 5xx, сеть),
+дописываются ещё BLOCK_RETRY_ROUNDS проходами в том же запуске — лист
+не остаётся очищенным и записанным наполовину из-за одного сбоя;
+остальные ошибки поднимаются сразу. Записанные блоки отмечаются в локальном JSON
+(CHECKPOINT_FILE): если запуск всё же упал, повторный с теми же данными не
+чистит лист заново, а дописывает только недостающие блоки. После успешной
+записи отметка джобы удаляется.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from gspread.utils import rowcol_to_a1
+
+import api_metrics
+from sheets_client import api_retry, is_transient
+
+CHECKPOINT_FILE = os.environ.get("BULK_WRITE_STATE_FILE", ".bulk_write_state.json")
+MAX_BLOCK_BYTES = 2_000_000   # ориентир на размер тела одного запроса
+MAX_BLOCK_ROWS = 10_000
+WRITE_WORKERS = 4
+BLOCK_RETRY_ROUNDS = 2        # повторные проходы по недописанным блокам внутри запуска
+BLOCK_RETRY_PAUSE = 10.0      # пауза перед проходом (секунды, растёт с номером прохода)
+
+_lock = threading.RLock()
+
+
+def _load_state():
+    try:
+        with open(CHECKPOINT_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_job(job, entry):
+    with _lock:
+        state = _load_state()
+        if entry is None:
+            state.pop(job, None)
+        else:
+            state[job] = entry
+        tmp = CHECKPOINT_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, CHECKPOINT_FILE)
+
+
+def _cell(v):
+    if hasattr(v, "item"):  # numpy-скаляры -> обычные python-значения
+        v = v.item()
+    if v is None or (isinstance(v, float) and v != v):
+        return ""
+    if isinstance(v, (str, int, float, bool)):
+        return v
+    return str(v)
+
+
+def frame_values(df, include_header=True):
+    """DataFrame -> список строк для Sheets API (NaN/None -> "", прочие типы -> str)."""
+    rows = [[_cell(v) for v in rec] for rec in df.astype(object).itertuples(index=False, name=None)]
+    if include_header:
+        rows.insert(0, [str(c) for c in df.columns])
+    return rows
+
+
+def split_blocks(values, start_row=1, max_bytes=MAX_BLOCK_BYTES, max_rows=MAX_BLOCK_ROWS):
+    """
+    Режет строки на блоки [(номер первой строки в листе, строки)], чтобы каждый
+    блок укладывался в max_bytes (по JSON-размеру) и max_rows.
+    """
+    blocks = []
+    first, size = 0, 0
+    for i, row in enumerate(values):
+        row_bytes = len(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+        if i > first and (size + row_bytes > max_bytes or i - first >= max_rows):
+            blocks.append((start_row + first, values[first:i]))
+            first, size = i, 0
+        size += row_bytes
+    if first < len(values):
+        blocks.append((start_row + first, values[first:]))
+    return blocks
+
+
+def payload_digest(ws, values, start_row):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{ws.spreadsheet_id}:{ws.id}:{start_row}".encode("utf-8"))
+    for row in values:
+        h.update(json.dumps(row, ensure_ascii=False).encode("utf-8"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+def write_values(ws, values, job, start_row=1, clear_ranges=None,
+                 value_input_option="USER_ENTERED", max_workers=WRITE_WORKERS):
+    """
+    Пишет values (список строк) в ws с A{start_row} блоками и параллельно.
+    clear_ranges — что очистить перед записью (None => весь лист);
+    при возобновлении прерванной записи тех же данных очистка пропускается.
+    """
+    digest = payload_digest(ws, values, start_row)
+    saved = _load_state().get(job)
+    done = set(saved["done"]) if saved and saved.get("digest") == digest else None
+
+    width = max((len(r) for r in values), default=0)
+    needed_rows = start_row + len(values) - 1
+    if ws.row_count < needed_rows or ws.col_count < width:
+        api_retry(ws.resize, rows=max(ws.row_count, needed_rows), cols=max(ws.col_count, width))
+
+    if done is None:
+        done = set()
+        if clear_ranges is None:
+            api_retry(ws.clear)
+        elif clear_ranges:
+            api_retry(ws.batch_clear, clear_ranges)
+        _save_job(job, {"digest": digest, "done": []})
+    else:
+        logging.info(f"↻ {job}: resuming write, {len(done)} block(s) already written")
+
+    blocks = split_blocks(values, start_row, MAX_BLOCK_BYTES, MAX_BLOCK_ROWS)
+    blocks = [(row, rows) for row, rows in blocks if row not in done]
+    logging.info(f"→ {job}: writing {len(values)} rows in {len(blocks)} block(s)")
+
+    def _write(block):
+        row, rows = block
+        api_retry(ws.update, rows, rowcol_to_a1(row, 1), value_input_option=value_input_option)
+        with _lock:
+            done.add(row)
+            _save_job(job, {"digest": digest, "done": sorted(done)})
+
+    write = api_metrics.bind_job(_write)
+    for attempt in range(BLOCK_RETRY_ROUNDS + 1):
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [(block, pool.submit(write, block)) for block in blocks]
+        failed = [(block, f.exception()) for block, f in futures if f.exception() is not None]
+        if not failed:
+            break
+        fatal = [e for _, e in failed if not is_transient(e)]
+        if fatal:
+            # 400/403/404 повтор не исправит — сразу наверх, чекпоинт остаётся
+            logging.error(f"❌ {job}: {len(failed)} block(s) not written ({fatal[0]}), checkpoint kept for the next run")
+            raise fatal[0]
+        if attempt == BLOCK_RETRY_ROUNDS:
+            logging.error(f"❌ {job}: {len(failed)} block(s) not written, checkpoint kept for the next run")
+            raise failed[0][1]
+        blocks = [block for block, _ in failed]
+        delay = BLOCK_RETRY_PAUSE * (attempt + 1)
+        logging.warning(f"{job}: {len(blocks)} block(s) failed ({failed[0][1]}), retrying in {delay:.0f}s")
+        time.sleep(delay)
+
+    _save_job(job, None)
+
+
+def write_frame(ws, df, job, start_row=1, include_header=True, **kwargs):
+    """Как set_with_dataframe, но через write_values (блоки + возобновление)."""
+    write_values(ws, frame_values(df, include_header), job, start_row=start_row, **kwargs)
@@ -1,14 +1,15 @@
 #!/usr/bin/env python3
 import os
 import json
+import hashlib
 import logging
-import time
 
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from gspread_dataframe import set_with_dataframe
-from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import rowcol_to_a1
+
+from sheets_client import api_retry, open_worksheet, fetch_all_values
+from source_state import sources_changed, remember
+from bulk_writer import write_frame, write_values
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
@@ -20,60 +21,15 @@ SRC_SHEET_NAME = "All lesson reviews NEW"
 DEST_SS_ID = "1yJmskKLGinBNKIV3ewXsVEfnh-JRj_FhuKyElL93vM4"
 DEST_SHEET_NAME = "data"
 
+# Отметка синхронизации (high-water mark): сколько строк уже скопировано
+# и хэш заголовка и последних TAIL_ROWS из них — чтобы дописывать только новые отзывы
+HWM_FILE = os.environ.get("EVAL_HWM_FILE", ".evaluation_hwm.json")
+TAIL_ROWS = 50
+
 
-def api_retry_open(client, key, max_attempts=5, backoff=1.0):
-    for i in range(1, max_attempts + 1):
-        try:
-            logging.info(f"open_by_key attempt {i}/{max_attempts}")
-            return client.open_by_key(key)
-        except APIError as e:
-            code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and i < max_attempts:
-                logging.warning(f"open_by_key got {code}, retrying in {backoff:.1f}s")
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            raise
-
-
-def api_retry_worksheet(sh, title, max_attempts=5, backoff=1.0):
-    for i in range(1, max_attempts + 1):
-        try:
-            logging.info(f"worksheet('{title}') attempt {i}/{max_attempts}")
-            return sh.worksheet(title)
-        except APIError as e:
-            code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and i < max_attempts:
-                logging.warning(f"worksheet got {code}, retrying in {backoff:.1f}s")
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            raise
-        except WorksheetNotFound:
-            logging.error(f"Worksheet '{title}' not found")
-            raise
-
-
-def fetch_all_values_with_retries(ws, max_attempts=5, backoff=1.0):
-    for i in range(1, max_attempts + 1):
-        try:
-            logging.info(f"get_all_values() attempt {i}/{max_attempts}")
-            return ws.get_all_values()
-        except APIError as e:
-            code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and i < max_attempts:
-                logging.warning(f"get_all_values got {code}, retrying in {backoff:.1f}s")
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            logging.error(f"get_all_values failed: {e}")
-            raise
-
-
-def get_all_columns(client, ss_id, sheet_name):
-    sh = api_retry_open(client, ss_id)
-    ws = api_retry_worksheet(sh, sheet_name)
-    all_vals = fetch_all_values_with_retries(ws)
+def get_all_columns(ss_id, sheet_name):
+    ws = open_worksheet(ss_id, sheet_name)
+    all_vals = fetch_all_values(ws)
 
     if not all_vals or len(all_vals) < 2:
         logging.error(f"Нет данных в листе {sheet_name}")
@@ -84,38 +40,114 @@ def get_all_columns(client, ss_id, sheet_name):
     return df
 
 
-def main():
-    # Авторизация
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/drive"
-    ]
-    sa_info = json.loads(os.environ["GCP_SERVICE_ACCOUNT"])
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(sa_info, scope)
-    client = gspread.authorize(creds)
-    logging.info("✔ Авторизованы в Google Sheets")
-
-    # Получаем данные только из одного источника
-    df = get_all_columns(client, SRC_SS_ID, SRC_SHEET_NAME)
+def rows_hash(rows, width):
+    h = hashlib.blake2b(digest_size=16)
+    for r in rows:
+        cells = (list(r) + [""] * width)[:width]
+        h.update("\x1f".join(cells).encode("utf-8"))
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+
+def make_hwm(header, data_tail, total_rows):
+    """data_tail — последние строки данных (хэшируются последние TAIL_ROWS)."""
+    width = len(header)
+    return {
+        "rows": total_rows,
+        "width": width,
+        "header": rows_hash([header], width),
+        "tail": rows_hash(data_tail[-TAIL_ROWS:], width),
+    }
+
+
+def load_hwm():
+    try:
+        with open(HWM_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_hwm(hwm):
+    tmp = HWM_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(hwm, f)
+    os.replace(tmp, HWM_FILE)
+
+
+def read_since_mark(ws, hwm):
+    """
+    Читает заголовок и строки источника начиная с окна хвоста перед отметкой.
+    Возвращает (header, строки окна хвоста, новые строки) или None, если выше отметки что-то поменялось
+    (заголовок, хвост, удалённые/вставленные строки) — тогда нужна полная пересинхронизация.
+    """
+    n, width = hwm["rows"], hwm["width"]
+    tail_len = min(n, TAIL_ROWS)
+    first = n - tail_len + 2  # данные с 2-й строки листа
+    last_col = ''.join(filter(str.isalpha, rowcol_to_a1(1, max(ws.col_count, width))))
+    header_block, rows_block = api_retry(ws.batch_get, ["1:1", f"A{first}:{last_col}"])
+    header = list(header_block[0]) if header_block else []
+    rows = [list(r) for r in rows_block]
+
+    if len(header) > width or rows_hash([header], width) != hwm["header"]:
+        return None
+    if len(rows) < tail_len or rows_hash(rows[:tail_len], width) != hwm["tail"]:
+        return None
+    new_rows = rows[tail_len:]
+    if any(len(r) > width for r in new_rows):
+        return None
+    tail = [(r + [""] * width)[:width] for r in rows[:tail_len]]
+    return (header + [""] * width)[:width], tail, [(r + [""] * width)[:width] for r in new_rows]
+
+
+def full_sync(ws_dst):
+    df = get_all_columns(SRC_SS_ID, SRC_SHEET_NAME)
     if df is None or df.empty:
         logging.error("❌ Нет данных для записи.")
-        return
-
-    # Запись в целевой лист
-    sh_dst = api_retry_open(client, DEST_SS_ID)
-    ws_dst = api_retry_worksheet(sh_dst, DEST_SHEET_NAME)
-
-    ws_dst.clear()
-    set_with_dataframe(
-        ws_dst,
-        df,
-        row=1,
-        col=1,
-        include_index=False,
-        include_column_header=True
-    )
+        return None
+
+    # Очистка листа + запись блоками (упавшая запись продолжится при повторе)
+    write_frame(ws_dst, df, "evaluation_analytics", start_row=1, include_header=True)
 
     logging.info(f"✔ Данные записаны в «{DEST_SHEET_NAME}» — {df.shape[0]} строк, {df.shape[1]} колонок")
+    save_hwm(make_hwm(list(df.columns), df.values.tolist(), len(df)))
+    return df
+
+
+def main():
+    # 0) Если источник не менялся с прошлого успешного запуска — ничего не делаем
+    changed, fingerprints = sources_changed("evaluation_analytics", [SRC_SS_ID])
+    if not changed:
+        logging.info("✔ Источник не менялся, пропускаем запуск")
+        return None
+
+    ws_dst = open_worksheet(DEST_SS_ID, DEST_SHEET_NAME)
+
+    # Отзывы почти всегда только дописываются: читаем лишь строки после отметки
+    hwm = load_hwm()
+    since = None
+    if hwm and os.environ.get("FORCE_SYNC") != "1":
+        since = read_since_mark(open_worksheet(SRC_SS_ID, SRC_SHEET_NAME), hwm)
+        if since is None:
+            logging.warning("Источник изменён выше отметки синхронизации — полная перезапись")
+
+    if since is None:
+        df = full_sync(ws_dst)
+        if df is None:
+            return
+    else:
+        header, tail, new_rows = since
+        df = pd.DataFrame(new_rows, columns=header)
+        if new_rows:
+            start_row = hwm["rows"] + 2
+            write_values(ws_dst, new_rows, "evaluation_analytics_append", start_row=start_row, clear_ranges=[])
+            logging.info(f"✔ Дописано в «{DEST_SHEET_NAME}» — {len(new_rows)} строк с A{start_row}")
+        else:
+            logging.info("✔ Новых строк нет")
+        save_hwm(make_hwm(header, tail + new_rows, hwm["rows"] + len(new_rows)))
+
+    remember("evaluation_analytics", fingerprints)
+    return df
 
 
 if __name__ == "__main__":
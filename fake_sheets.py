@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+"""
+Локальный стенд Google Sheets без ключей и сети — для бенчмарков и ручных прогонов.
+
+Настоящий HTTP-сервер (ThreadingHTTPServer) с таблицами в памяти. Реализует то,
+чем пользуются наши скрипты:
+- Sheets v4: spreadsheets.get, values get / batchGet / update / batchUpdate /
+  clear / batchClear, spreadsheets.batchUpdate (resize, updateCells,
+  appendDimension, copyPaste, deleteSheet), sheets.copyTo;
+- CSV-экспорт docs.google.com/.../export?format=csv&gid=…;
+- Drive v3 files.get (version / modifiedTime для детектора изменений).
+
+Умеет добавлять задержку и случайные 5xx / 429 (с Retry-After), считает вызовы
+и байты по типам запросов.
+
+Клиенты ходят на стенд через redirect_session(): запрос на
+https://sheets.googleapis.com/… уходит на http://127.0.0.1:PORT/sheets.googleapis.com/….
+Для наших скриптов достаточно sheets_client.use_session(server.session()).
+
+    python fake_sheets.py --port 8765 --latency 0.05 --errors 0.02 --quota 0.01
+"""
+import re
+import csv
+import io
+import json
+import time
+import random
+import argparse
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, unquote
+
+import requests
+from gspread.utils import a1_to_rowcol, rowcol_to_a1
+
+from api_metrics import InstrumentedAdapter
+
+DEFAULT_ROWS = 1000
+DEFAULT_COLS = 26
+NUMBER_RE = re.compile(r"^-?\d+(\.\d+)?$")
+
+
+class ApiError(Exception):
+    def __init__(self, code, message, status="INVALID_ARGUMENT"):
+        super().__init__(message)
+        self.code, self.status = code, status
+
+
+# === Данные ===
+class Sheet:
+    def __init__(self, sheet_id, title, grid=None, rows=None, cols=None):
+        self.id, self.title = sheet_id, title
+        self.grid = [list(r) for r in (grid or [])]
+        self.rows = max(rows or DEFAULT_ROWS, len(self.grid))
+        self.cols = max(cols or DEFAULT_COLS, max((len(r) for r in self.grid), default=0))
+
+    def properties(self, index=0):
+        return {
+            "sheetId": self.id, "title": self.title, "index": index, "sheetType": "GRID",
+            "gridProperties": {"rowCount": self.rows, "columnCount": self.cols},
+        }
+
+    def cell(self, r, c):
+        row = self.grid[r] if r < len(self.grid) else ()
+        return row[c] if c < len(row) else ""
+
+    def set_cell(self, r, c, v):
+        while len(self.grid) <= r:
+            self.grid.append([])
+        row = self.grid[r]
+        if len(row) <= c:
+            if v == "":
+                return
+            row.extend([""] * (c + 1 - len(row)))
+        row[c] = v
+
+    def read(self, r0, c0, r1, c1):
+        """Значения прямоугольника как в API: без хвостовых пустых ячеек и строк."""
+        out = []
+        for r in range(r0, min(r1, len(self.grid))):
+            row = [self.cell(r, c) for c in range(c0, c1)]
+            while row and row[-1] == "":
+                row.pop()
+            out.append(row)
+        while out and not out[-1]:
+            out.pop()
+        return out
+
+
+class Book:
+    def __init__(self, ss_id, title=None):
+        self.id, self.title = ss_id, title or ss_id
+        self.sheets = []
+        self.version = 1
+        self.modified = datetime.now(timezone.utc)
+
+    def add_sheet(self, title, grid=None, rows=None, cols=None, sheet_id=None):
+        if sheet_id is None:
+            sheet_id = max((s.id for s in self.sheets), default=0) + 1
+        sheet = Sheet(sheet_id, title, grid, rows, cols)
+        self.sheets.append(sheet)
+        return sheet
+
+    def by_title(self, title):
+        for s in self.sheets:
+            if s.title == title:
+                return s
+        raise ApiError(400, f"Unable to parse range: {title}")
+
+    def by_id(self, sheet_id):
+        for s in self.sheets:
+            if s.id == sheet_id:
+                return s
+        raise ApiError(400, f"No grid with id: {sheet_id}")
+
+    def touch(self):
+        self.version += 1
+        self.modified = datetime.now(timezone.utc)
+
+
+def _col_index(letters):
+    return a1_to_rowcol(f"{letters}1")[1] - 1
+
+
+def parse_range(book, rng):
+    """
+    A1-диапазон -> (лист, r0, c0, r1, c1), 0-based, конец не включается.
+    r1/c1 = None для одиночной ячейки ("A2" — якорь записи).
+    """
+    if "!" in rng:
+        title, a1 = rng.rsplit("!", 1)
+        if title.startswith("'") and title.endswith("'"):
+            title = title[1:-1].replace("''", "'")
+    else:
+        bare = rng[1:-1].replace("''", "'") if rng.startswith("'") and rng.endswith("'") else rng
+        if any(s.title == bare for s in book.sheets):
+            title, a1 = bare, ""
+        else:
+            title, a1 = book.sheets[0].title, rng
+    sheet = book.by_title(title)
+    if not a1:
+        return sheet, 0, 0, sheet.rows, sheet.cols
+
+    parts = a1.upper().split(":")
+    m0 = re.fullmatch(r"([A-Z]*)(\d*)", parts[0])
+    if not m0:
+        raise ApiError(400, f"Unable to parse range: {rng}")
+    r0 = int(m0[2]) - 1 if m0[2] else 0
+    c0 = _col_index(m0[1]) if m0[1] else 0
+    if len(parts) == 1:
+        return sheet, r0, c0, None, None
+    m1 = re.fullmatch(r"([A-Z]*)(\d*)", parts[1])
+    if not m1:
+        raise ApiError(400, f"Unable to parse range: {rng}")
+    r1 = int(m1[2]) if m1[2] else sheet.rows
+    c1 = _col_index(m1[1]) + 1 if m1[1] else sheet.cols
+    return sheet, r0, c0, r1, c1
+
+
+def user_entered(v):
+    if isinstance(v, str) and NUMBER_RE.match(v.strip()):
+        num = float(v)
+        return int(num) if num.is_integer() and "." not in v else num
+    return v
+
+
+def formatted(v):
+    if isinstance(v, bool):
+        return "TRUE" if v else "FALSE"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return v if isinstance(v, str) else str(v)
+
+
+# === Сервер ===
+class FakeSheets:
+    """Хранилище + маршрутизация + инъекция задержек/ошибок + счётчики."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, quota_rate=0.0, retry_after=1, seed=0):
+        self.books = {}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_rate = quota_rate
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self.reset_stats()
+        self._httpd = None
+
+    # --- данные ---
+    def add_book(self, ss_id, title=None):
+        with self._lock:
+            return self.books.setdefault(ss_id, Book(ss_id, title))
+
+    def book(self, ss_id):
+        try:
+            return self.books[ss_id]
+        except KeyError:
+            raise ApiError(404, f"Requested entity was not found: {ss_id}", "NOT_FOUND")
+
+    # --- счётчики ---
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {"calls": defaultdict(int), "bytes_in": 0, "bytes_out": 0, "errors_injected": 0}
+
+    def snapshot_stats(self):
+        with self._lock:
+            return {
+                "calls": dict(self.stats["calls"]),
+                "total_calls": sum(self.stats["calls"].values()),
+                "bytes_in": self.stats["bytes_in"],
+                "bytes_out": self.stats["bytes_out"],
+                "errors_injected": self.stats["errors_injected"],
+            }
+
+    # --- запуск ---
+    def start(self, host="127.0.0.1", port=0):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, headers, payload = fake.handle(self.command, self.path, body)
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = _serve
+
+            def log_message(self, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def session(self):
+        return redirect_session(self.base_url)
+
+    # --- обработка ---
+    def handle(self, method, raw_path, body):
+        """-> (status, headers, bytes). Путь: /<исходный host>/<исходный path>?query."""
+        if self.latency:
+            time.sleep(self.latency)
+        split = urlsplit(raw_path)
+        host, _, path = split.path.lstrip("/").partition("/")
+        path = "/" + path
+        query = parse_qs(split.query, keep_blank_values=True)
+        kind = "unknown"
+        try:
+            kind, handler = self.route(method, host, path)
+            with self._lock:
+                self.stats["calls"][kind] += 1
+                self.stats["bytes_in"] += len(body)
+                roll = self._rng.random()
+            if roll < self.quota_rate:
+                raise ApiError(429, "Quota exceeded", "RESOURCE_EXHAUSTED")
+            if roll < self.quota_rate + self.error_rate:
+                raise ApiError(503, "The service is currently unavailable.", "UNAVAILABLE")
+            data = json.loads(body) if body else {}
+            with self._lock:
+                result = handler(path, query, data)
+            if isinstance(result, bytes):
+                status, headers, payload = 200, {"Content-Type": "text/csv; charset=utf-8"}, result
+            else:
+                status, headers, payload = 200, {"Content-Type": "application/json"}, json.dumps(result).encode()
+        except ApiError as e:
+            if e.code in (429, 503):
+                with self._lock:
+                    self.stats["errors_injected"] += 1
+            headers = {"Content-Type": "application/json"}
+            if e.code == 429:
+                headers["Retry-After"] = str(self.retry_after)
+            status = e.code
+            payload = json.dumps({"error": {"code": e.code, "message": str(e), "status": e.status}}).encode()
+        with self._lock:
+            self.stats["bytes_out"] += len(payload)
+        return status, headers, payload
+
+    def route(self, method, host, path):
+        if host == "docs.google.com" and re.fullmatch(r"/spreadsheets/d/[^/]+/export", path):
+            return "export.csv", self.export_csv
+        if host == "www.googleapis.com" and path.startswith("/drive/v3/files/"):
+            return "drive.files.get", self.drive_get
+        if host != "sheets.googleapis.com":
+            raise ApiError(404, f"Unknown host {host}", "NOT_FOUND")
+        routes = [
+            ("GET",  r"/v4/spreadsheets/[^/:]+",                       "spreadsheets.get",         self.spreadsheet_get),
+            ("POST", r"/v4/spreadsheets/[^/:]+:batchUpdate",           "spreadsheets.batchUpdate", self.batch_update),
+            ("POST", r"/v4/spreadsheets/[^/:]+/sheets/\d+:copyTo",     "sheets.copyTo",            self.copy_to),
+            ("GET",  r"/v4/spreadsheets/[^/:]+/values:batchGet",       "values.batchGet",          self.values_batch_get),
+            ("POST", r"/v4/spreadsheets/[^/:]+/values:batchUpdate",    "values.batchUpdate",       self.values_batch_update),
+            ("POST", r"/v4/spreadsheets/[^/:]+/values:batchClear",     "values.batchClear",        self.values_batch_clear),
+            ("POST", r"/v4/spreadsheets/[^/:]+/values/.+:clear",       "values.clear",             self.values_clear),
+            ("GET",  r"/v4/spreadsheets/[^/:]+/values/.+",             "values.get",               self.values_get),
+            ("PUT",  r"/v4/spreadsheets/[^/:]+/values/.+",             "values.update",            self.values_update),
+        ]
+        for verb, pattern, kind, handler in routes:
+            if verb == method and re.fullmatch(pattern, path):
+                return kind, handler
+        raise ApiError(404, f"Unknown endpoint {method} {path}", "NOT_FOUND")
+
+    @staticmethod
+    def _ss_id(path):
+        return unquote(path.split("/")[3].split(":")[0])
+
+    @staticmethod
+    def _range_in_path(path):
+        rng = unquote(path.split("/values/", 1)[1])
+        return rng[:-len(":clear")] if rng.endswith(":clear") else rng
+
+    # --- Sheets: метаданные и структура ---
+    def spreadsheet_get(self, path, query, data):
+        book = self.book(self._ss_id(path))
+        return {
+            "spreadsheetId": book.id,
+            "properties": {"title": book.title, "locale": "en_US", "timeZone": "Etc/GMT"},
+            "sheets": [{"properties": s.properties(i)} for i, s in enumerate(book.sheets)],
+        }
+
+    def copy_to(self, path, query, data):
+        src = self.book(self._ss_id(path))
+        sheet = src.by_id(int(path.rsplit("/", 1)[1].split(":")[0]))
+        dst = self.book(data["destinationSpreadsheetId"])
+        copy = dst.add_sheet(f"Copy of {sheet.title}", sheet.grid, sheet.rows, sheet.cols)
+        dst.touch()
+        return copy.properties(len(dst.sheets) - 1)
+
+    def batch_update(self, path, query, data):
+        book = self.book(self._ss_id(path))
+        replies = []
+        for req in data.get("requests", []):
+            (kind, spec), = req.items()
+            if kind == "updateSheetProperties":
+                props = spec["properties"]
+                sheet = book.by_id(props.get("sheetId", 0))
+                grid = props.get("gridProperties", {})
+                sheet.rows = grid.get("rowCount", sheet.rows)
+                sheet.cols = grid.get("columnCount", sheet.cols)
+                if "title" in props:
+                    sheet.title = props["title"]
+                del sheet.grid[sheet.rows:]
+            elif kind == "appendDimension":
+                sheet = book.by_id(spec["sheetId"])
+                if spec["dimension"] == "ROWS":
+                    sheet.rows += spec["length"]
+                else:
+                    sheet.cols += spec["length"]
+            elif kind == "updateCells":
+                sheet, r0, c0, r1, c1 = self._grid_range(book, spec["range"])
+                for r in range(r0, min(r1, len(sheet.grid))):
+                    for c in range(c0, c1):
+                        sheet.set_cell(r, c, "")
+            elif kind == "copyPaste":
+                src, sr0, sc0, sr1, sc1 = self._grid_range(book, spec["source"])
+                dst, dr0, dc0, _, _ = self._grid_range(book, spec["destination"])
+                if dr0 + (sr1 - sr0) > dst.rows or dc0 + (sc1 - sc0) > dst.cols:
+                    raise ApiError(400, "Paste range exceeds grid limits")
+                block = [[src.cell(r, c) for c in range(sc0, sc1)] for r in range(sr0, sr1)]
+                for i, row in enumerate(block):
+                    for j, v in enumerate(row):
+                        dst.set_cell(dr0 + i, dc0 + j, v)
+            elif kind == "deleteSheet":
+                book.sheets.remove(book.by_id(spec["sheetId"]))
+            else:
+                raise ApiError(400, f"Unsupported request: {kind}")
+            replies.append({})
+        book.touch()
+        return {"spreadsheetId": book.id, "replies": replies}
+
+    @staticmethod
+    def _grid_range(book, rng):
+        sheet = book.by_id(rng.get("sheetId", 0))
+        r1 = rng.get("endRowIndex", sheet.rows)
+        c1 = rng.get("endColumnIndex", sheet.cols)
+        if r1 > sheet.rows or c1 > sheet.cols:
+            raise ApiError(400, f"Range exceeds grid limits. Max rows: {sheet.rows}")
+        return sheet, rng.get("startRowIndex", 0), rng.get("startColumnIndex", 0), r1, c1
+
+    # --- Sheets: значения ---
+    def _read(self, book, rng, query):
+        sheet, r0, c0, r1, c1 = parse_range(book, rng)
+        if r1 is None:
+            r1, c1 = r0 + 1, c0 + 1
+        values = sheet.read(r0, c0, r1, c1)
+        if query.get("valueRenderOption", ["FORMATTED_VALUE"])[0] == "FORMATTED_VALUE":
+            values = [[formatted(v) for v in row] for row in values]
+        out = {"range": rng, "majorDimension": "ROWS"}
+        if values:
+            out["values"] = values
+        return out
+
+    def values_get(self, path, query, data):
+        return self._read(self.book(self._ss_id(path)), self._range_in_path(path), query)
+
+    def values_batch_get(self, path, query, data):
+        book = self.book(self._ss_id(path))
+        return {"spreadsheetId": book.id, "valueRanges": [self._read(book, r, query) for r in query.get("ranges", [])]}
+
+    def _write(self, book, rng, values, option):
+        sheet, r0, c0, r1, c1 = parse_range(book, rng)
+        height = len(values)
+        width = max((len(r) for r in values), default=0)
+        if r0 + height > sheet.rows or c0 + width > sheet.cols:
+            raise ApiError(400, f"Range ('{sheet.title}'!{rowcol_to_a1(r0 + height, c0 + max(width, 1))}) "
+                                f"exceeds grid limits. Max rows: {sheet.rows}, max columns: {sheet.cols}")
+        for i, row in enumerate(values):
+            for j, v in enumerate(row):
+                v = "" if v is None else v
+                sheet.set_cell(r0 + i, c0 + j, user_entered(v) if option == "USER_ENTERED" else v)
+        book.touch()
+        return {"updatedRange": rng, "updatedRows": height, "updatedColumns": width,
+                "updatedCells": sum(len(r) for r in values)}
+
+    def values_update(self, path, query, data):
+        option = query.get("valueInputOption", ["RAW"])[0]
+        return self._write(self.book(self._ss_id(path)), self._range_in_path(path), data.get("values", []), option)
+
+    def values_batch_update(self, path, query, data):
+        book = self.book(self._ss_id(path))
+        option = data.get("valueInputOption", "RAW")
+        responses = [self._write(book, d["range"], d.get("values", []), option) for d in data.get("data", [])]
+        if data.get("includeValuesInResponse"):
+            render = {"valueRenderOption": [data.get("responseValueRenderOption", "FORMATTED_VALUE")]}
+            for d, r in zip(data.get("data", []), responses):
+                r["updatedData"] = self._read(book, d["range"], render)
+        return {"spreadsheetId": book.id, "totalUpdatedCells": sum(r["updatedCells"] for r in responses),
+                "responses": responses}
+
+    def _clear(self, book, rng):
+        sheet, r0, c0, r1, c1 = parse_range(book, rng)
+        if r1 is None:
+            r1, c1 = r0 + 1, c0 + 1
+        for r in range(r0, min(r1, len(sheet.grid))):
+            for c in range(c0, min(c1, len(sheet.grid[r]))):
+                sheet.grid[r][c] = ""
+        book.touch()
+        return {"clearedRange": rng}
+
+    def values_clear(self, path, query, data):
+        book = self.book(self._ss_id(path))
+        return {"spreadsheetId": book.id, **self._clear(book, self._range_in_path(path))}
+
+    def values_batch_clear(self, path, query, data):
+        book = self.book(self._ss_id(path))
+        return {"spreadsheetId": book.id, "clearedRanges": [self._clear(book, r)["clearedRange"] for r in data.get("ranges", [])]}
+
+    # --- экспорт и Drive ---
+    def export_csv(self, path, query, data):
+        book = self.book(path.split("/")[3])
+        sheet = book.by_id(int(query.get("gid", ["0"])[0]))
+        rows = sheet.read(0, 0, sheet.rows, sheet.cols)
+        width = max((len(r) for r in rows), default=0)
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        for r in rows:
+            writer.writerow([formatted(v) for v in r] + [""] * (width - len(r)))
+        return buf.getvalue().encode("utf-8")
+
+    def drive_get(self, path, query, data):
+        book = self.book(unquote(path.rsplit("/", 1)[1]))
+        return {"version": str(book.version), "modifiedTime": book.modified.strftime("%Y-%m-%dT%H:%M:%S.%fZ")}
+
+
+# === Клиентская сторона ===
+class RedirectAdapter(InstrumentedAdapter):
+    """https://<host>/<path> -> <base_url>/<host>/<path>; остальное (включая учёт api_metrics) как в скриптах."""
+
+    def __init__(self, base_url, **kwargs):
+        self.base_url = base_url.rstrip("/")
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.url = f"{self.base_url}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
+        return super().send(request, **kwargs)
+
+
+def redirect_session(base_url, pool_size=16):
+    session = requests.Session()
+    session.mount("https://", RedirectAdapter(base_url, pool_connections=pool_size, pool_maxsize=pool_size))
+    session.headers["Authorization"] = "Bearer fake-token"
+    return session
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Google Sheets server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--errors", type=float, default=0.0, help="share of requests failing with 503")
+    parser.add_argument("--quota", type=float, default=0.0, help="share of requests failing with 429")
+    parser.add_argument("--rows", type=int, default=2000, help="rows per seeded source sheet")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from benchmark import seed_books
+    fake = FakeSheets(args.latency, args.errors, args.quota, seed=args.seed)
+    seed_books(fake, args.rows, args.seed)
+    fake.start(args.host, args.port)
+    print(f"Fake Sheets on {fake.base_url} ({len(fake.books)} spreadsheets). Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
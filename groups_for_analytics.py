@@ -1,15 +1,13 @@
 #!/usr/bin/env python3
-import os
-import json
+import re
 import logging
-import time
-import io
 
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from gspread_dataframe import set_with_dataframe
-from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.utils import rowcol_to_a1
+
+from sheets_client import api_retry, open_worksheet
+from source_state import sources_changed, remember
+from bulk_writer import write_frame
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
@@ -19,88 +17,91 @@ SOURCE_SHEET_NAME = "groups"
 DEST_SS_ID = "1yJmskKLGinBNKIV3ewXsVEfnh-JRj_FhuKyElL93vM4"
 DEST_SHEET_NAME = "group data"
 
-def api_retry_open(client, key, max_attempts=5, backoff=1.0):
-    for i in range(1, max_attempts+1):
-        try:
-            logging.info(f"open_by_key attempt {i}/{max_attempts}")
-            return client.open_by_key(key)
-        except APIError as e:
-            code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and i < max_attempts:
-                logging.warning(f"open_by_key got {code}, retrying in {backoff:.1f}s")
-                time.sleep(backoff); backoff *= 2
-                continue
-            raise
-
-def api_retry_worksheet(sh, title, max_attempts=5, backoff=1.0):
-    for i in range(1, max_attempts+1):
-        try:
-            logging.info(f"worksheet('{title}') attempt {i}/{max_attempts}")
-            return sh.worksheet(title)
-        except APIError as e:
-            code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and i < max_attempts:
-                logging.warning(f"worksheet got {code}, retrying in {backoff:.1f}s")
-                time.sleep(backoff); backoff *= 2
-                continue
-            raise
-        except WorksheetNotFound:
-            logging.error(f"Worksheet '{title}' not found")
-            raise
-
-def fetch_all_values_with_retries(ws, max_attempts=5, backoff=1.0):
-    for i in range(1, max_attempts+1):
-        try:
-            logging.info(f"get_all_values() attempt {i}/{max_attempts}")
-            return ws.get_all_values()
-        except APIError as e:
-            code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and i < max_attempts:
-                logging.warning(f"get_all_values got {code}, retrying in {backoff:.1f}s")
-                time.sleep(backoff); backoff *= 2
-                continue
-            logging.error(f"get_all_values failed: {e}")
-            raise
+# Фильтр по колонке B: оставляем группы, в названии которых есть любой из кодов
+VALUES_TO_KEEP = ["COL", "ESP", "CHI"]
+GROUP_MATCHER = re.compile("|".join(map(re.escape, VALUES_TO_KEEP)))
+# Совпавшие строки, между которыми не больше ROW_GAP лишних, читаем одним диапазоном
+ROW_GAP = 5
+# Сколько диапазонов отправлять в одном batch_get (длина URL ограничена)
+RANGES_PER_REQUEST = 200
+
+
+def coalesce_rows(rows, gap=ROW_GAP):
+    """[2, 3, 4, 9, 30] -> [(2, 4), (9, 9), (30, 30)] при gap=3: близкие строки — один блок."""
+    blocks = []
+    for r in rows:
+        if blocks and r - blocks[-1][1] <= gap + 1:
+            blocks[-1] = (blocks[-1][0], r)
+        else:
+            blocks.append((r, r))
+    return blocks
+
+
+def fetch_matching_rows(ws, col_idx=1):
+    """
+    Двухфазное чтение: сначала заголовок и одна колонка фильтра, затем только
+    диапазоны строк, где она совпала с GROUP_MATCHER. Возвращает (header, rows, всего строк).
+    Строки читаются на всю ширину листа и, как в get_all_values, дополняются до самой
+    широкой (вместе с заголовком) — данные правее последней подписанной колонки не теряются.
+    """
+    col = ''.join(filter(str.isalpha, rowcol_to_a1(1, col_idx + 1)))
+    header_block, col_block = api_retry(ws.batch_get, ["1:1", f"{col}2:{col}"])
+    header = header_block[0] if header_block else []
+    if not header:
+        return [], [], 0
+
+    keys = [r[0] if r else "" for r in col_block]
+    matched = [i + 2 for i, v in enumerate(keys) if GROUP_MATCHER.search(v)]  # номера строк в листе
+    last_col = ''.join(filter(str.isalpha, rowcol_to_a1(1, max(ws.col_count, len(header)))))
+
+    blocks = coalesce_rows(matched)
+    wanted = set(matched)
+    rows = []
+    for i in range(0, len(blocks), RANGES_PER_REQUEST):
+        part = blocks[i:i + RANGES_PER_REQUEST]
+        batch = api_retry(ws.batch_get, [f"A{a}:{last_col}{b}" for a, b in part])
+        for (a, b), values in zip(part, batch):
+            values = list(values) + [[]] * (b - a + 1 - len(values))
+            for row_no, r in enumerate(values, start=a):
+                if row_no in wanted:
+                    rows.append(list(r))
+    width = max([len(header)] + [len(r) for r in rows])
+    header = list(header) + [""] * (width - len(header))
+    rows = [r + [""] * (width - len(r)) for r in rows]
+    logging.info(f"→ Фильтр по {col}: {len(matched)} из {len(keys)} строк, {len(blocks)} диапазонов")
+    return header, rows, len(keys)
 
 def main():
-    # Авторизация
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    sa_info = json.loads(os.environ["GCP_SERVICE_ACCOUNT"])
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(sa_info, scope)
-    client = gspread.authorize(creds)
-    logging.info("✔ Авторизованы в Google Sheets")
+    # 0) Если источник не менялся с прошлого успешного запуска — ничего не делаем
+    changed, fingerprints = sources_changed("groups_for_analytics", [SOURCE_SS_ID])
+    if not changed:
+        logging.info("✔ Источник не менялся, пропускаем запуск")
+        return None
 
     # Открываем исходный лист
-    sh_src = api_retry_open(client, SOURCE_SS_ID)
-    ws_src = api_retry_worksheet(sh_src, SOURCE_SHEET_NAME)
+    ws_src = open_worksheet(SOURCE_SS_ID, SOURCE_SHEET_NAME)
 
-    # Грузим все значения
-    all_vals = fetch_all_values_with_retries(ws_src)
-    if not all_vals or len(all_vals) < 2:
+    # Грузим только колонку B, фильтруем по ней и дочитываем совпавшие строки
+    header, rows, total = fetch_matching_rows(ws_src, col_idx=1)
+    if not header or total == 0:
         logging.error("❌ Нет данных для импорта.")
         return
 
-    # В датафрейм
-    df = pd.DataFrame(all_vals[1:], columns=all_vals[0])
+    print("Всего строк (без заголовка):", total)
 
-    print("Всего строк (без заголовка):", len(df))
+    # В датафрейм (уже отфильтрованный по B)
+    filtered_df = pd.DataFrame(rows, columns=header)
     print("Первые 5 строк:")
-    print(df.head())
-
-
-    # Фильтруем по B
-    values_to_keep = ["COL", "ESP", "CHI"]
-    mask = df[df.columns[1]].str.contains('|'.join(values_to_keep), na=False)
-    filtered_df = df[mask].reset_index(drop=True)
+    print(filtered_df.head())
     logging.info(f"→ Получено строк после фильтрации: {filtered_df.shape[0]}")
 
     # Записываем в целевой лист
-    sh_dst = api_retry_open(client, DEST_SS_ID)
-    ws_dst = api_retry_worksheet(sh_dst, DEST_SHEET_NAME)
-    ws_dst.clear()  # Полностью очищаем лист
-    set_with_dataframe(ws_dst, filtered_df, row=1, col=1,
-                       include_index=False, include_column_header=True)
+    ws_dst = open_worksheet(DEST_SS_ID, DEST_SHEET_NAME)
+    # Полностью очищаем лист и пишем блоками
+    write_frame(ws_dst, filtered_df, "groups_for_analytics", start_row=1, include_header=True)
     logging.info(f"✔ Данные записаны в «{DEST_SHEET_NAME}» — {filtered_df.shape[0]} строк")
+    remember("groups_for_analytics", fingerprints)
+    return filtered_df
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Запуск синков одним процессом как DAG.
+
+Каждый узел — это main() одного из скриптов. Если узел зависит от другого,
+результат (DataFrame) верхнего узла передаётся в main() нижнего аргументом,
+и нижний не перечитывает тот же лист из Sheets. Независимые ветки
+выполняются параллельно, авторизация и кэш листов общие (sheets_client).
+
+    python pipeline.py                                   # все узлы
+    python pipeline.py update_lessons qa_rating_update   # выбранные + их зависимости
+"""
+import sys
+import time
+import logging
+import importlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import api_metrics
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+# узел -> (модуль скрипта, {аргумент main(): узел, чей результат туда передаём})
+NODES = {
+    "update_lessons":        ("update_lessons",        {}),
+    # в режиме copy lessons_df не читается: ребро держит порядок (Lessons уже записан),
+    # а кадр нужен только при откате QA-rating-update на режим values
+    "qa_rating_update":      ("QA-rating-update",      {"lessons_df": "update_lessons"}),
+    "qa_qa":                 ("QA_QA",                 {}),
+    "update_tutors_qa":      ("update_tutors_QA",      {}),
+    "evaluation_analytics":  ("evaluation_analytics",  {}),
+    "groups_for_analytics":  ("groups_for_analytics",  {}),
+    "lessons_for_analytics": ("lessons_for_analytics", {}),
+}
+MAX_WORKERS = 4
+
+
+def select_nodes(nodes, names):
+    """Оставляет только названные узлы и всё, от чего они зависят."""
+    if not names:
+        return dict(nodes)
+    picked = {}
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name in picked:
+            continue
+        if name not in nodes:
+            raise KeyError(f"Unknown pipeline node '{name}'")
+        picked[name] = nodes[name]
+        stack.extend(nodes[name][1].values())
+    return picked
+
+
+def topo_order(nodes):
+    order = []
+    state = {}  # name -> "visiting" | "done"
+
+    def visit(name):
+        if state.get(name) == "done":
+            return
+        if state.get(name) == "visiting":
+            raise ValueError(f"Cycle in pipeline at '{name}'")
+        state[name] = "visiting"
+        for dep in nodes[name][1].values():
+            visit(dep)
+        state[name] = "done"
+        order.append(name)
+
+    for name in nodes:
+        visit(name)
+    return order
+
+
+def run_node(name, module_name, kwargs):
+    start = time.perf_counter()
+    api_metrics.set_job(name)
+    logging.info(f"▶ {name} started")
+    result = importlib.import_module(module_name).main(**kwargs)
+    logging.info(f"✔ {name} finished in {time.perf_counter() - start:.1f}s")
+    return result
+
+
+def run(nodes=NODES, names=None, max_workers=MAX_WORKERS):
+    """
+    Выполняет узлы в топологическом порядке; узел стартует, как только готовы его входы.
+    Возвращает (results, failed): результаты main() по узлам и множество упавших/пропущенных.
+    """
+    nodes = select_nodes(nodes, names)
+    pending = topo_order(nodes)
+    results, failed = {}, set()
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for name in list(pending):
+                module_name, inputs = nodes[name]
+                deps = set(inputs.values())
+                if deps & failed:
+                    logging.error(f"✖ {name} skipped: upstream {sorted(deps & failed)} failed")
+                    failed.add(name)
+                    pending.remove(name)
+                elif deps <= results.keys():
+                    kwargs = {arg: results[dep] for arg, dep in inputs.items()}
+                    running[pool.submit(run_node, name, module_name, kwargs)] = name
+                    pending.remove(name)
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                name = running.pop(fut)
+                try:
+                    results[name] = fut.result()
+                except Exception:
+                    logging.exception(f"✖ {name} failed")
+                    failed.add(name)
+
+    return results, failed
+
+
+def main():
+    _, failed = run(names=sys.argv[1:])
+    if failed:
+        logging.error(f"❌ Pipeline finished with failures: {sorted(failed)}")
+        sys.exit(1)
+    logging.info("✔ Pipeline finished")
+
+
+if __name__ == "__main__":
+    main()
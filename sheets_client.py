@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Общий слой доступа к Google Sheets для всех скриптов.
+
+- одна авторизация и один keep-alive HTTP-пул на процесс;
+- кэш открытых таблиц и листов (open_by_key / worksheet вызываются один раз);
+- единая политика повторов для 5xx и 429 (с учётом Retry-After);
+- каждый HTTP-вызов и каждый повтор учитываются в api_metrics.
+"""
+import os
+import json
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import gspread
+import requests
+from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession
+from gspread.exceptions import APIError
+
+import api_metrics
+
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+RETRY_CODES = {429, 500, 502, 503, 504}
+POOL_SIZE = 16
+
+_lock = threading.RLock()
+_session = None
+_client = None
+_spreadsheets = {}
+_worksheets = {}
+_open_locks = {}  # ключ таблицы/листа -> Lock: открываем один раз, но разные ключи — параллельно
+
+
+def get_credentials():
+    info = json.loads(os.environ["GCP_SERVICE_ACCOUNT"])
+    return Credentials.from_service_account_info(info, scopes=SCOPES)
+
+
+def get_session():
+    """Авторизованная requests-сессия с пулом keep-alive соединений (одна на процесс)."""
+    global _session
+    with _lock:
+        if _session is None:
+            session = AuthorizedSession(get_credentials())
+            adapter = api_metrics.InstrumentedAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            _session = session
+        return _session
+
+
+def get_client():
+    global _client
+    with _lock:  # authorize только создаёт клиента — сети здесь нет
+        if _client is None:
+            session = get_session()
+            _client = gspread.authorize(session.credentials, session=session)
+            logging.info("✔ Authenticated to Google Sheets")
+        return _client
+
+
+def use_session(session):
+    """
+    Подменяет HTTP-сессию процесса (локальный стенд fake_sheets, бенчмарки).
+    Клиент gspread и кэши таблиц/листов сбрасываются.
+    """
+    global _session, _client
+    with _lock:
+        _session = session
+        _client = gspread.Client(None, session=session)
+        _spreadsheets.clear()
+        _worksheets.clear()
+
+
+def _status_code(exc):
+    code = getattr(exc, "code", None)
+    if isinstance(code, int):
+        return code
+    resp = getattr(exc, "response", None)
+    if resp is None:
+        return None
+    code = getattr(resp, "status_code", None) or getattr(resp, "status", None)
+    return int(code) if code else None
+
+
+def is_transient(exc):
+    """Ошибка, которую имеет смысл повторить: 429, 5xx из RETRY_CODES или сетевой сбой."""
+    if isinstance(exc, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return isinstance(exc, (APIError, requests.HTTPError)) and _status_code(exc) in RETRY_CODES
+
+
+def _retry_after(exc):
+    resp = getattr(exc, "response", None)
+    headers = getattr(resp, "headers", None) or {}
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def api_retry(func, *args, max_attempts=5, initial_backoff=1.0, **kwargs):
+    """
+    Вызывает func(*args, **kwargs), повторяя при 429, 5xx и сетевых ошибках
+    с экспоненциальной паузой.
+    Для 429 пауза не меньше Retry-After, если сервер его прислал.
+    """
+    backoff = initial_backoff
+    name = getattr(func, "__name__", "call")
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return func(*args, **kwargs)
+        except (APIError, requests.HTTPError, requests.ConnectionError, requests.Timeout) as e:
+            code = _status_code(e)
+            if not is_transient(e) or attempt == max_attempts:
+                raise
+            delay = backoff + random.uniform(0, backoff / 2)
+            if code == 429:
+                delay = max(delay, _retry_after(e) or 0)
+            logging.warning(f"{name} got {code or e} (attempt {attempt}/{max_attempts}), retrying in {delay:.1f}s")
+            api_metrics.record_retry(name, delay)
+            time.sleep(delay)
+            backoff *= 2
+
+
+def _open_lock(key):
+    with _lock:
+        return _open_locks.setdefault(key, threading.Lock())
+
+
+def open_spreadsheet(key):
+    # сетевой вызов — под замком только этой таблицы, не общего _lock
+    with _open_lock(("spreadsheet", key)):
+        sh = _spreadsheets.get(key)
+        if sh is None:
+            sh = api_retry(get_client().open_by_key, key)
+            _spreadsheets[key] = sh
+        return sh
+
+
+def open_worksheet(key, title):
+    with _open_lock(("worksheet", key, title)):
+        ws = _worksheets.get((key, title))
+        if ws is None:
+            sh = open_spreadsheet(key)
+            ws = api_retry(sh.worksheet, title)
+            _worksheets[(key, title)] = ws
+        return ws
+
+
+def fetch_all_values(ws):
+    return api_retry(ws.get_all_values)
+
+
+@contextmanager
+def open_csv_stream(url, timeout=(10, 120)):
+    """
+    Открывает CSV-экспорт потоком через ту же авторизованную сессию.
+    Повторяется только установка соединения; тело читается по мере скачивания.
+    """
+    def _open():
+        r = get_session().get(url, timeout=timeout, stream=True)
+        try:
+            r.raise_for_status()
+        except requests.HTTPError:
+            r.close()
+            raise
+        return r
+    r = api_retry(_open)
+    try:
+        r.raw.decode_content = True
+        yield r.raw
+    finally:
+        r.close()
+
+
+def fetch_drive_metadata(file_id, fields="version,modifiedTime"):
+    """Метаданные файла из Drive API v3 — один лёгкий запрос без чтения ячеек."""
+    url = f"https://www.googleapis.com/drive/v3/files/{file_id}"
+    def _get():
+        r = get_session().get(url, params={"fields": fields, "supportsAllDrives": "true"}, timeout=(10, 30))
+        r.raise_for_status()
+        return r.json()
+    return api_retry(_get)
+
+
+def values_batch_get(key, ranges, **params):
+    """
+    Один values.batchGet по таблице key: диапазоны могут быть с разных листов
+    ('Лист'!A1:A). Таблицу не открываем — запрос идёт напрямую, без open_by_key.
+    Возвращает список valueRanges в порядке ranges.
+    """
+    url = f"https://sheets.googleapis.com/v4/spreadsheets/{key}/values:batchGet"
+    def _get():
+        r = get_session().get(url, params={"ranges": list(ranges), **params}, timeout=(10, 120))
+        r.raise_for_status()
+        return r.json().get("valueRanges", [])
+    return api_retry(_get)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Даты Google Sheets <-> datetime64, целыми колонками.
+
+В Sheets дата — число дней от 1899-12-30 (serial number), время — доля суток.
+Все функции принимают массивы/Series/списки и работают векторно (NumPy/pandas),
+пустые строки, None и NaN дают NaT / NaN без построчного Python-кода.
+"""
+import numpy as np
+import pandas as pd
+
+SHEETS_EPOCH = pd.Timestamp("1899-12-30")
+DAY = np.timedelta64(1, "D")
+# Serial numbers, которые помещаются в datetime64[ns] (примерно 1677..2262 годы)
+SERIAL_MIN = (pd.Timestamp.min.ceil("D").to_pydatetime() - SHEETS_EPOCH.to_pydatetime()).days
+SERIAL_MAX = (pd.Timestamp.max.floor("D").to_pydatetime() - SHEETS_EPOCH.to_pydatetime()).days
+# Текст вида "45321" считаем serial только в разумных пределах (1970..2100),
+# иначе "2024" или "20240115" превратились бы в даты XIX века / переполнение
+TEXT_SERIAL_MIN = 25_569
+TEXT_SERIAL_MAX = 73_051
+
+
+def _as_series(values):
+    return values if isinstance(values, pd.Series) else pd.Series(values, dtype=object)
+
+
+def parse_dates(values, dayfirst=False):
+    """
+    Текст ячеек / serial numbers / datetime -> Series datetime64[ns].
+    Разбирает только уникальные значения (в колонке дат их обычно мало)
+    и раскладывает результат обратно по кодам.
+    """
+    s = _as_series(values)
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        return s
+    index = s.index
+    s = s.replace("", None) if s.dtype == object else s
+    codes, uniques = pd.factorize(s, use_na_sentinel=True)
+    uniques = pd.Series(uniques, dtype=object)
+
+    # 45321.5 из UNFORMATTED_VALUE — serial number; текст "45321.5" — только в разумных пределах,
+    # остальной текст и datetime/Timestamp разбирает to_datetime
+    number = uniques.map(lambda v: isinstance(v, (int, float, np.number)) and not isinstance(v, (bool, np.bool_)))
+    text = uniques.map(lambda v: isinstance(v, str))
+    numeric = pd.to_numeric(uniques.where(number | text), errors="coerce")
+    text_serial = text & numeric.between(TEXT_SERIAL_MIN, TEXT_SERIAL_MAX)
+    is_serial = (number & numeric.notna()) | text_serial
+    parsed = pd.Series(pd.NaT, index=uniques.index, dtype="datetime64[ns]")
+    if is_serial.any():
+        parsed[is_serial] = from_serial(numeric[is_serial].to_numpy(dtype="float64"))
+    rest = ~is_serial & ~number
+    if rest.any():
+        # format="mixed": каждая строка разбирается сама по себе (ISO, "15/01/2024", "20240115"),
+        # без угадывания одного формата по первой ячейке
+        parsed[rest] = pd.to_datetime(
+            uniques[rest], errors="coerce", dayfirst=dayfirst, format="mixed"
+        ).astype("datetime64[ns]")
+
+    out = parsed.to_numpy()[codes]
+    out[codes < 0] = np.datetime64("NaT")
+    return pd.Series(out, index=index, dtype="datetime64[ns]")
+
+
+def to_serial(values, dayfirst=False):
+    """Даты -> float64 массив serial numbers (дни + доля суток), NaT -> NaN."""
+    dt = parse_dates(values, dayfirst=dayfirst).to_numpy(dtype="datetime64[ns]")
+    return (dt - SHEETS_EPOCH.to_datetime64()) / DAY
+
+
+def to_time_fraction(values):
+    """Время суток -> доля суток (float64, с точностью до секунды), NaT -> NaN."""
+    dt = parse_dates(values).to_numpy(dtype="datetime64[s]")
+    return (dt - dt.astype("datetime64[D]")) / DAY
+
+
+def from_serial(serials):
+    """Serial numbers Sheets (дни от 1899-12-30) -> datetime64[ns], NaN и вне диапазона -> NaT."""
+    days = np.asarray(serials, dtype="float64")
+    with np.errstate(invalid="ignore"):
+        blank = ~((days >= SERIAL_MIN) & (days <= SERIAL_MAX))
+    ms = np.round(np.where(blank, 0, days) * 86_400_000).astype("int64")  # Sheets хранит до миллисекунд
+    out = SHEETS_EPOCH.to_datetime64() + ms.astype("timedelta64[ms]").astype("timedelta64[ns]")
+    out[blank] = np.datetime64("NaT")
+    return out
+
+
+def with_blanks(numbers, blank=""):
+    """NaN -> blank, чтобы пустые даты уходили в лист пустыми ячейками."""
+    arr = np.asarray(numbers, dtype="float64")
+    out = arr.astype(object)
+    out[np.isnan(arr)] = blank
+    return out
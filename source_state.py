@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Детектор изменений источников: чтобы не гонять полный fetch → transform → write,
+когда исходная таблица не менялась с прошлого успешного запуска.
+
+Отпечаток источника — version + modifiedTime из Drive (один метазапрос).
+Отпечатки хранятся по джобам в локальном JSON (STATE_FILE); в GitHub Actions
+файл переживает запуски через actions/cache. FORCE_SYNC=1 отключает пропуск.
+"""
+import os
+import json
+import logging
+import threading
+
+from sheets_client import fetch_drive_metadata
+
+STATE_FILE = os.environ.get("SHEETS_STATE_FILE", ".sheets_state.json")
+
+_lock = threading.Lock()
+
+
+def _load_state():
+    try:
+        with open(STATE_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def source_fingerprint(ss_id):
+    try:
+        meta = fetch_drive_metadata(ss_id)
+    except Exception as e:
+        logging.warning(f"Drive metadata for {ss_id} unavailable ({e}), treating source as changed")
+        return None
+    return f"{meta.get('version')}:{meta.get('modifiedTime')}"
+
+
+def sources_changed(job, ss_ids):
+    """
+    Возвращает (changed, fingerprints). changed=False, только если у всех источников
+    джобы отпечаток совпал с сохранённым после прошлого успешного запуска.
+    """
+    fingerprints = {ss_id: source_fingerprint(ss_id) for ss_id in dict.fromkeys(ss_ids)}
+    if os.environ.get("FORCE_SYNC") == "1":
+        return True, fingerprints
+    if any(fp is None for fp in fingerprints.values()):
+        return True, fingerprints
+    with _lock:
+        saved = _load_state().get(job)
+    return saved != fingerprints, fingerprints
+
+
+def remember(job, fingerprints):
+    """Сохраняет отпечатки после успешной записи (иначе следующий запуск повторит работу)."""
+    if any(fp is None for fp in fingerprints.values()):
+        return
+    with _lock:
+        state = _load_state()
+        state[job] = fingerprints
+        tmp = STATE_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2, sort_keys=True)
+        os.replace(tmp, STATE_FILE)
@@ -1,19 +1,34 @@
 #!/usr/bin/env python3
 import os
 import io
+import sys
 import time
 import hmac
+import marshal
+import pstats
+import cProfile
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 st.set_page_config(layout="wide")
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 import pandas.api.types as pt
 import requests
 from google.auth.transport.requests import Request
 from google.oauth2.service_account import Credentials
 from urllib.parse import quote
 
+import api_metrics
+from sheets_dates import parse_dates
+
 # === Константы ===
 LESSONS_SS       = "1_S-NyaVKuOc0xK12PBAYvdIauDBq9mdqHlnKLfSYNAE"
 LATAM_GID        = "0"
@@ -30,6 +45,19 @@ QA_SHEET         = "QA - Lesson evaluation"
 REPL_SS          = "1LF2NrAm8J3c43wOoumtsyfQsX1z0_lUQVdByGSPe27U"
 REPL_SHEET       = "Replacement"
 
+# Сколько источников build_df грузит параллельно
+LOAD_WORKERS     = int(os.getenv("LOAD_WORKERS", "7"))
+# Размеры страницы таблицы: в браузер уходит только текущая страница
+PAGE_SIZES       = [100, 250, 500, 1000]
+# Как часто фоновый поток пересобирает кадр (секунды)
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", "900"))
+# Снимок собранного кадра на диске (Arrow IPC) для быстрого холодного старта.
+# Версию поднимать при изменении колонок build_df — старые снимки тогда игнорируются.
+SNAPSHOT_VERSION = 2
+SNAPSHOT_PATH    = os.path.join(os.getenv("SNAPSHOT_DIR", ".snapshots"), f"qa_dashboard_v{SNAPSHOT_VERSION}.arrow")
+# Метка вызовов дашборда в api_metrics; отчёт пишется после каждой пересборки
+METRICS_RUN      = "streamlit_qa_dashboard"
+
 # === Simple app password gate ===
 def check_app_password():
     if st.session_state.get("auth_ok", False):
@@ -49,8 +77,20 @@ def check_app_password():
         pwd_input = st.text_input("Password", type="password")
         submitted = st.form_submit_button("Enter")
 
+    # отдельный пароль открывает ещё и админ-панель профилирования; не задан — её нет
+    admin_password = os.getenv("ADMIN_PASSWORD")
+    if not admin_password:
+        try:
+            admin_password = st.secrets.get("ADMIN_PASSWORD", None)
+        except FileNotFoundError:  # нет secrets.toml
+            admin_password = None
+
     if submitted:
-        if hmac.compare_digest(str(pwd_input), str(app_password)):
+        if admin_password and hmac.compare_digest(str(pwd_input), str(admin_password)):
+            st.session_state["auth_ok"] = True
+            st.session_state["is_admin"] = True
+            st.rerun()
+        elif hmac.compare_digest(str(pwd_input), str(app_password)):
             st.session_state["auth_ok"] = True
             st.rerun()
         else:
@@ -59,7 +99,8 @@ def check_app_password():
     st.stop()
 
 # === Auth helpers ===
-@st.cache_data(show_spinner=False)
+# cache_resource, а не cache_data: нужен один и тот же объект, чтобы токен жил между вызовами
+@st.cache_resource(show_spinner=False)
 def get_creds():
     import json
     raw = os.getenv("GCP_SERVICE_ACCOUNT")
@@ -70,9 +111,23 @@ def get_creds():
     scopes = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
     return Credentials.from_service_account_info(info, scopes=scopes)
 
+@st.cache_resource(show_spinner=False)
+def get_api_counters():
+    """Общие на процесс счётчики чтений Sheets API и обновлений токена (ответы не кэшируются)."""
+    return {
+        "lock": threading.Lock(),
+        "fetches": 0,
+        "token_refreshes": 0,
+    }
+
 def get_auth_header():
     creds = get_creds()
-    creds.refresh(Request())
+    counters = get_api_counters()
+    with counters["lock"]:
+        # обновляем токен только когда его нет или он истекает
+        if not creds.valid:
+            creds.refresh(Request())
+            counters["token_refreshes"] += 1
     return {"Authorization": f"Bearer {creds.token}"}
 
 def api_retry(func, *args, max_attempts=5, initial_backoff=1.0, **kwargs):
@@ -83,32 +138,208 @@ def api_retry(func, *args, max_attempts=5, initial_backoff=1.0, **kwargs):
         except requests.HTTPError as e:
             code = e.response.status_code
             if 500 <= code < 600 and i < max_attempts:
+                api_metrics.record_retry(getattr(func, "__name__", "call"), backoff)
                 time.sleep(backoff)
                 backoff *= 2
                 continue
             raise
 
+# === Профилирование стадий ===
+# Профиль текущей сборки (или прогона UI); в воркеры пула попадает через initializer
+# До 3.12 cProfile видит только свой поток; с 3.12 (sys.monitoring) один профилировщик
+# видит все потоки, а второй одновременно запустить нельзя (ValueError)
+PROFILE_PER_THREAD = sys.version_info < (3, 12)
+_build_profile = contextvars.ContextVar("build_profile", default=None)
+
+def rss_mb() -> float:
+    """Резидентная память процесса, МБ (Linux /proc; на других ОС — NaN)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, IndexError):
+        return float("nan")
+
+class BuildProfile:
+    """
+    Стадии одной сборки кадра или прогона UI: время и прирост RSS на стадию.
+    stage() — вложенный блок, lap() — отрезок от предыдущей отметки этого потока.
+    С cprofile=True сборка ещё и пишется в cProfile (см. runcall).
+    Прирост RSS общий на процесс: у параллельных загрузчиков он смешивается.
+    """
+    def __init__(self, cprofile: bool = False):
+        self.started   = time.perf_counter()
+        self.cprofile  = cprofile
+        self.stages    = []
+        self.profilers = []
+        self._profiling = False   # 3.12+: профилировщик уже запущен (один на процесс)
+        self._lock     = threading.Lock()
+        self._local    = threading.local()   # depth, mark, profiling — свои у каждого потока
+        self._local.mark = (self.started, rss_mb())
+
+    def _record(self, name, start, rss_before):
+        depth = getattr(self._local, "depth", 0)
+        now = time.perf_counter()
+        with self._lock:
+            self.stages.append({
+                "stage":   "  " * depth + name,
+                "depth":   depth,
+                "thread":  threading.current_thread().name,
+                "start_s": round(start - self.started, 3),
+                "seconds": round(now - start, 3),
+                "rss_delta_mb": round(rss_mb() - rss_before, 1),
+            })
+        self._local.mark = (now, rss_mb())
+
+    @contextmanager
+    def stage(self, name: str):
+        start, rss = time.perf_counter(), rss_mb()
+        depth = getattr(self._local, "depth", 0)
+        self._local.depth, self._local.mark = depth + 1, (start, rss)
+        try:
+            yield
+        finally:
+            self._local.depth = depth
+            self._record(name, start, rss)
+
+    def lap(self, name: str):
+        start, rss = getattr(self._local, "mark", None) or (self.started, float("nan"))
+        self._record(name, start, rss)
+
+    def _claim_profiler(self) -> bool:
+        if PROFILE_PER_THREAD:
+            if getattr(self._local, "profiling", False):
+                return False
+            self._local.profiling = True
+            return True
+        with self._lock:
+            if self._profiling:
+                return False
+            self._profiling = True
+            return True
+
+    def _release_profiler(self):
+        if PROFILE_PER_THREAD:
+            self._local.profiling = False
+        else:
+            with self._lock:
+                self._profiling = False
+
+    def runcall(self, fn, *args):
+        """
+        fn(*args) под cProfile, если он включён и ещё не запущен:
+        до 3.12 — свой профилировщик на поток, с 3.12 — один на всю сборку.
+        """
+        if not self.cprofile or not self._claim_profiler():
+            return fn(*args)
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # 3.12+: уже работает чужой профилировщик — собираем без cProfile
+            self._release_profiler()
+            return fn(*args)
+        try:
+            return fn(*args)
+        finally:
+            profiler.disable()
+            self._release_profiler()
+            with self._lock:
+                self.profilers.append(profiler)
+
+    def frame(self) -> pd.DataFrame:
+        with self._lock:
+            rows = sorted(self.stages, key=lambda r: (r["start_s"], r["depth"]))
+        return pd.DataFrame(rows, columns=["stage", "thread", "start_s", "seconds", "rss_delta_mb"])
+
+    def pstats_dump(self) -> bytes | None:
+        """Профили всех потоков одним pstats-дампом (как Stats.dump_stats), None без cProfile."""
+        with self._lock:
+            profilers = list(self.profilers)
+        if not profilers:
+            return None
+        stats = pstats.Stats(*profilers)
+        return marshal.dumps(stats.stats)
+
+    def pstats_top(self, limit: int = 30) -> str:
+        with self._lock:
+            profilers = list(self.profilers)
+        if not profilers:
+            return ""
+        out = io.StringIO()
+        pstats.Stats(*profilers, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+def stage(name: str):
+    """Блок-стадия текущего профиля; без профиля — пустой контекст."""
+    profile = _build_profile.get()
+    return profile.stage(name) if profile is not None else nullcontext()
+
+def lap(name: str) -> None:
+    profile = _build_profile.get()
+    if profile is not None:
+        profile.lap(name)
+
+def run_stage(name: str, fn, *args):
+    """fn(*args) как стадия name (и под cProfile, если он включён) — обёртка задач пула."""
+    profile = _build_profile.get()
+    if profile is None:
+        return fn(*args)
+    with profile.stage(name):
+        return profile.runcall(fn, *args)
+
 # === CSV-экспорт для публичных листов ===
 def fetch_csv(ss_id: str, gid: str) -> pd.DataFrame:
     url = f"https://docs.google.com/spreadsheets/d/{ss_id}/export?format=csv&gid={gid}"
     # Убираем headers=get_auth_header()
-    resp = api_retry(requests.get, url, timeout=20)
-    resp.raise_for_status()
+    with stage(f"download CSV gid={gid}"):
+        resp = api_retry(api_metrics.observed_get, url, timeout=20)
+        resp.raise_for_status()
     try:
-        return pd.read_csv(io.StringIO(resp.text), dtype=str)
+        with stage("parse CSV"):
+            return pd.read_csv(io.StringIO(resp.text), dtype=str)
     except pd.errors.EmptyDataError:
         return pd.DataFrame()
 
 # === Google Sheets API v4 для приватных range ===
-def fetch_values(ss_id: str, sheet_name: str) -> list[list[str]]:
+# Значения без форматирования: числа приходят числами, даты — serial numbers (не зависят от локали листа)
+VALUE_RENDER = {"valueRenderOption": "UNFORMATTED_VALUE", "dateTimeRenderOption": "SERIAL_NUMBER"}
+# Текст как в листе: для Rating — там нет дат, а проценты и округлённые средние
+# должны выглядеть в таблице и CSV как в листе ("85%", а не 0.85)
+FORMATTED_RENDER = {"valueRenderOption": "FORMATTED_VALUE"}
+
+def fetch_values(ss_id: str, sheet_name: str, render: dict = VALUE_RENDER) -> list[list]:
+    counters = get_api_counters()
+    with counters["lock"]:
+        counters["fetches"] += 1
+
     encoded = quote(sheet_name, safe='')
     url     = f"https://sheets.googleapis.com/v4/spreadsheets/{ss_id}/values/{encoded}"
-    headers = get_auth_header()
-    resp    = api_retry(requests.get, url, headers=headers)
-    resp.raise_for_status()
-    return resp.json().get("values", [])
+    with stage(f"fetch values {sheet_name}"):
+        headers = get_auth_header()
+        resp    = api_retry(api_metrics.observed_get, url, headers=headers, params=render)
+        resp.raise_for_status()
+        return resp.json().get("values", [])
 
 # === Загрузчики ===
+def cell_text(v) -> str:
+    """Типизированное значение ячейки -> текст как в листе для ключей (12345.0 -> "12345")."""
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return v if isinstance(v, str) else str(v)
+
+def as_text(values: pd.Series) -> pd.Series:
+    """Колонка идентификаторов в текст: форматируем только уникальные значения."""
+    codes, uniques = pd.factorize(values)
+    text = np.array([cell_text(v) for v in uniques] + [None], dtype=object)
+    return pd.Series(text[codes], index=values.index, dtype=object)
+
+def rows_frame(rows: list[list], positions: list[int], names: list[str]) -> pd.DataFrame:
+    """
+    Колонки positions из «рваных» строк API одним DataFrame-конструктором:
+    короткие строки дополняются None, а не вручную в цикле.
+    """
+    table = pd.DataFrame(rows).reindex(columns=range(max(positions) + 1))
+    return table[positions].set_axis(names, axis=1)
+
 def load_public_lessons(ss_id: str, gid: str, region: str) -> pd.DataFrame:
     raw = fetch_csv(ss_id, gid)
     cols = [
@@ -124,7 +355,7 @@ def load_public_lessons(ss_id: str, gid: str, region: str) -> pd.DataFrame:
         "Course ID","Module","Lesson","Lesson Link"
     ]
     df["Region"] = region
-    df["Date of the lesson"] = pd.to_datetime(df["Date of the lesson"], errors="coerce")
+    df["Date of the lesson"] = parse_dates(df["Date of the lesson"])
     return df
 
 def load_rating(ss_id: str) -> pd.DataFrame:
@@ -135,7 +366,7 @@ def load_rating(ss_id: str) -> pd.DataFrame:
         "Average QA marker","Average QA marker (last 2 markers within last 90 days)"
     ]
     try:
-        rows = fetch_values(ss_id, RATING_SHEET)
+        rows = fetch_values(ss_id, RATING_SHEET, FORMATTED_RENDER)
     except requests.HTTPError:
         return pd.DataFrame(columns=want)
     if not rows or len(rows)<2:
@@ -144,15 +375,16 @@ def load_rating(ss_id: str) -> pd.DataFrame:
         header, data = rows[0], rows[1:]
     else:
         header, data = rows[1], rows[2:]
-    maxc   = max(len(header), *(len(r) for r in data))
-    header = header + [""]*(maxc-len(header))
-    data   = [r+[""]*(maxc-len(r)) for r in data]
-    df     = pd.DataFrame(data, columns=header)
+    table  = pd.DataFrame(data)
+    maxc   = max(len(header), table.shape[1])
+    header = [cell_text(h) for h in header] + [""]*(maxc-len(header))
+    df     = table.reindex(columns=range(maxc)).fillna("").set_axis(header, axis=1)
     if "ID" in df.columns and "Tutor ID" not in df.columns:
         df = df.rename(columns={"ID":"Tutor ID"})
     for c in want:
         if c not in df.columns:
             df[c] = pd.NA
+    df["Tutor ID"] = as_text(df["Tutor ID"])
     return df[want]
 
 def load_qa(ss_id: str) -> pd.DataFrame:
@@ -163,98 +395,278 @@ def load_qa(ss_id: str) -> pd.DataFrame:
         return pd.DataFrame(columns=want)
     if not rows or len(rows)<2:
         return pd.DataFrame(columns=want)
-    data = rows[1:]
-    df = pd.DataFrame({
-        "Tutor ID":           [r[6]  if len(r)>6 else pd.NA for r in data],
-        "Date of the lesson": pd.to_datetime([r[1] if len(r)>1 else None for r in data],
-                                              errors="coerce", dayfirst=True),
-        "QA score":           [r[2]  if len(r)>2 else pd.NA for r in data],
-        "QA marker":          [r[3]  if len(r)>3 else pd.NA for r in data],
-    })
+    df = rows_frame(rows[1:], [6, 1, 2, 3], want)
+    df["Tutor ID"] = as_text(df["Tutor ID"])
+    # даты-ячейки уже serial numbers; dayfirst нужен только для дат, введённых текстом
+    df["Date of the lesson"] = parse_dates(df["Date of the lesson"], dayfirst=True)
     return df
 
 def load_replacements() -> pd.DataFrame:
     rows = fetch_values(REPL_SS, REPL_SHEET)
     if len(rows)<2:
         return pd.DataFrame(columns=["Date","Group","Replacement or not"])
-    data = rows[1:]
-    df   = pd.DataFrame({
-        "Date":      pd.to_datetime([r[3] if len(r)>3 else None for r in data], errors="coerce"),
-        "Group":     [r[5]  if len(r)>5 else pd.NA for r in data],
-        "Replacement or not": "Replacement/Postponement"
-    })
+    df = rows_frame(rows[1:], [3, 5], ["Date", "Group"])
+    df["Date"]  = parse_dates(df["Date"])
+    df["Group"] = as_text(df["Group"])
+    df["Replacement or not"] = "Replacement/Postponement"
     return df
 
-@st.cache_data(show_spinner=True)
+def submit_sources(pool):
+    """Запускает все загрузчики сразу; склейка ждёт только те future, которые ей нужны."""
+    return {
+        "lessons_lat": pool.submit(run_stage, "load_public_lessons LATAM", load_public_lessons, LESSONS_SS, LATAM_GID, "LATAM"),
+        "lessons_brz": pool.submit(run_stage, "load_public_lessons Brazil", load_public_lessons, LESSONS_SS, BRAZIL_GID, "Brazil"),
+        "rating_lat":  pool.submit(run_stage, "load_rating LATAM", load_rating, RATING_LATAM_SS),
+        "rating_brz":  pool.submit(run_stage, "load_rating Brazil", load_rating, RATING_BRAZIL_SS),
+        "qa_lat":      pool.submit(run_stage, "load_qa LATAM", load_qa, QA_LATAM_SS),
+        "qa_brz":      pool.submit(run_stage, "load_qa Brazil", load_qa, QA_BRAZIL_SS),
+        "repl":        pool.submit(run_stage, "load_replacements", load_replacements),
+    }
+
 def build_df():
+    ctx = get_script_run_ctx()
+    profile = _build_profile.get()
+    def init_worker():
+        add_script_run_ctx(threading.current_thread(), ctx)
+        api_metrics.set_job(METRICS_RUN)
+        _build_profile.set(profile)
+
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS, initializer=init_worker) as pool:
+        with stage("join_sources"):
+            df = join_sources(submit_sources(pool))
+    before = memory_mb(df)
+    with stage("apply_schema"):
+        df = apply_schema(df)
+    df.attrs["memory_mb"] = (before, memory_mb(df))
+    return df
+
+# === Типы итогового кадра ===
+# category — повторяющийся текст, float/int — nullable-числа (оценки и счётчики),
+# datetime — даты, string — длинный уникальный текст
+DTYPE_SCHEMA = {
+    "Tutor name":         "category",
+    "Tutor ID":           "category",
+    "Date of the lesson": "datetime",
+    "Group":              "category",
+    "Course ID":          "category",
+    "Module":             "category",
+    "Lesson":             "category",
+    "Lesson Link":        "string",
+    "Region":             "category",
+    "Rating w retention": "float",
+    "Num of QA scores":   "int",
+    "Num of QA scores (last 90 days)": "int",
+    "Average QA score":   "float",
+    "Average QA score (last 2 scores within last 90 days)": "float",
+    "Average QA marker":  "category",
+    "Average QA marker (last 2 markers within last 90 days)": "category",
+    "QA score":           "float",
+    "QA marker":          "category",
+    "Replacement or not": "category",
+    "Eval Date":          "datetime",
+    "Source":             "category",
+}
+
+def memory_mb(df: pd.DataFrame) -> float:
+    return df.memory_usage(deep=True).sum() / 2**20
+
+def to_number(s: pd.Series):
+    """
+    Числа из текста ячеек ("8,5" → 8.5; пустые и ошибки Sheets вида #N/A → NA).
+    None, если в колонке есть другой текст — тогда тип не меняем, чтобы его не потерять.
+    """
+    text = s.astype("string").str.strip().str.replace(",", ".", regex=False)
+    text = text.mask((text == "") | text.str.startswith("#"))
+    num = pd.to_numeric(text, errors="coerce")
+    if (num.isna() & text.notna()).any():
+        return None
+    return num
+
+def to_category(s: pd.Series) -> pd.Series:
+    """Категория из текста ячеек; типизированные значения (числа вперемешку с текстом) — в текст листа."""
+    if s.dtype == object:
+        s = as_text(s)
+    return s.astype("category")
+
+def apply_schema(df: pd.DataFrame) -> pd.DataFrame:
+    for col, kind in DTYPE_SCHEMA.items():
+        if col not in df.columns:
+            continue
+        s = df[col]
+        if kind == "datetime":
+            s = parse_dates(s)
+        elif kind in ("float", "int"):
+            num = to_number(s)
+            if num is None:
+                s = to_category(s)
+            elif kind == "int" and (num.dropna() % 1 == 0).all():
+                s = num.astype("Int64")
+            else:
+                s = num.astype("Float64")
+        elif kind == "category":
+            s = to_category(s)
+        else:
+            s = s.astype("string")
+        df[col] = s
+    return df
+
+# === Индексный join ===
+def key_codes(*tables):
+    """
+    Общие целочисленные коды ключа для нескольких таблиц: одинаковый ключ — один код.
+    tables — по списку колонок ключа (Series или массивы кодов) на таблицу.
+    Пустые значения тоже получают общий код: DataFrame.merge сопоставляет NaN с NaN.
+    Возвращает (список массивов кодов по таблицам, число кодов).
+    """
+    lengths = [len(cols[0]) for cols in tables]
+    combined, n = None, 1
+    for parts in zip(*tables):
+        values = pd.concat([pd.Series(p) for p in parts], ignore_index=True)
+        codes, uniques = pd.factorize(values)
+        codes = np.where(codes < 0, len(uniques), codes)
+        if combined is None:
+            combined, n = codes, len(uniques) + 1
+        else:
+            combined, uniq = pd.factorize(combined * (len(uniques) + 1) + codes)
+            n = len(uniq)
+    splits = np.cumsum(lengths)[:-1]
+    return np.split(combined, splits), n
+
+def build_join_index(codes: np.ndarray, n_codes: int) -> dict:
+    """Хэш-индекс правой таблицы: позиции её строк, сгруппированные по коду ключа."""
+    counts = np.bincount(codes, minlength=n_codes)
+    return {
+        "order":  np.argsort(codes, kind="stable"),
+        "counts": counts,
+        "starts": np.cumsum(counts) - counts,
+    }
+
+def left_join_positions(left_codes: np.ndarray, index: dict):
+    """
+    Позиции строк (left, right) результата left join в порядке DataFrame.merge:
+    строки левой таблицы по порядку, совпадения справа — в их исходном порядке.
+    right = -1, если пары нет.
+    """
+    cnt  = index["counts"][left_codes]
+    reps = np.maximum(cnt, 1)
+    left_pos = np.repeat(np.arange(len(left_codes)), reps)
+    offsets  = np.arange(len(left_pos)) - np.repeat(np.cumsum(reps) - reps, reps)
+    if len(index["order"]) == 0:
+        return left_pos, np.full(len(left_pos), -1)
+    slot = np.minimum(np.repeat(index["starts"][left_codes], reps) + offsets, len(index["order"]) - 1)
+    right_pos = np.where(np.repeat(cnt, reps) > 0, index["order"][slot], -1)
+    return left_pos, right_pos
+
+def take_rows(df: pd.DataFrame, pos: np.ndarray) -> pd.DataFrame:
+    """Строки по позициям; -1 даёт пустую строку (как у несовпавших строк в left join)."""
+    return df.reset_index(drop=True).reindex(pos).reset_index(drop=True)
+
+def indexed_left_join(left, right, left_codes, index, right_cols):
+    """left join по готовому индексу; справа берутся только right_cols. Возвращает (кадр, left_pos)."""
+    left_pos, right_pos = left_join_positions(left_codes, index)
+    out = pd.concat(
+        [left.iloc[left_pos].reset_index(drop=True), take_rows(right[right_cols], right_pos)],
+        axis=1,
+    )
+    return out, left_pos
+
+def join_sources(src):
     # === Публичные уроки + все твои склейки ===
-    df_lat = load_public_lessons(LESSONS_SS, LATAM_GID, "LATAM")
-    df_brz = load_public_lessons(LESSONS_SS, BRAZIL_GID, "Brazil")
+    df_lat = src["lessons_lat"].result()
+    df_brz = src["lessons_brz"].result()
+    lap("wait: lessons")
     df_public = pd.concat([df_lat, df_brz], ignore_index=True)
+    lap("concat lessons")
 
     rating_cols = [
         "Rating w retention","Num of QA scores","Num of QA scores (last 90 days)",
         "Average QA score","Average QA score (last 2 scores within last 90 days)",
         "Average QA marker","Average QA marker (last 2 markers within last 90 days)"
     ]
-    r_lat = (load_rating(RATING_LATAM_SS)
-             .rename(columns={c: c + "_lat" for c in rating_cols}))
-    r_brz = (load_rating(RATING_BRAZIL_SS)
-             .rename(columns={c: c + "_brz" for c in rating_cols}))
-
-    df_public = df_public.merge(r_lat, on="Tutor ID", how="left") \
-                         .merge(r_brz, on="Tutor ID", how="left")
-
-    for c in rating_cols:
-        df_public[c] = df_public[f"{c}_lat"].fillna(df_public[f"{c}_brz"])
-    df_public.drop([f"{c}_lat" for c in rating_cols] + [f"{c}_brz" for c in rating_cols],
-            axis=1, inplace=True)
-
-    # QA-оценки: сначала LATAM, потом Brazil, как раньше
-    q_lat = load_qa(QA_LATAM_SS).rename(
-        columns={"QA score":"QA score_lat","QA marker":"QA marker_lat"}
-    )
-    q_brz = load_qa(QA_BRAZIL_SS).rename(
-        columns={"QA score":"QA score_brz","QA marker":"QA marker_brz"}
+    r_lat = src["rating_lat"].result()
+    r_brz = src["rating_brz"].result()
+    q_lat = src["qa_lat"].result()
+    q_brz = src["qa_brz"].result()
+    lap("wait: rating, QA")
+
+    # Tutor ID хэшируется один раз на все таблицы; дальше коды только переносятся по позициям
+    (tid_pub, tid_rlat, tid_rbrz, tid_qlat, tid_qbrz), n_tid = key_codes(
+        [df_public["Tutor ID"]], [r_lat["Tutor ID"]], [r_brz["Tutor ID"]],
+        [q_lat["Tutor ID"]], [q_brz["Tutor ID"]],
     )
-    df_public = df_public.merge(q_lat, on=["Tutor ID","Date of the lesson"], how="left") \
-                         .merge(q_brz, on=["Tutor ID","Date of the lesson"], how="left")
 
-    for base in ["QA score","QA marker"]:
+    # Рейтинги: сначала LATAM, потом Brazil, одной блочной заливкой
+    lat_cols = [c + "_lat" for c in rating_cols]
+    brz_cols = [c + "_brz" for c in rating_cols]
+    df_public, pos = indexed_left_join(df_public, r_lat.rename(columns=dict(zip(rating_cols, lat_cols))),
+                                       tid_pub, build_join_index(tid_rlat, n_tid), lat_cols)
+    tid_pub = tid_pub[pos]
+    df_public, pos = indexed_left_join(df_public, r_brz.rename(columns=dict(zip(rating_cols, brz_cols))),
+                                       tid_pub, build_join_index(tid_rbrz, n_tid), brz_cols)
+    tid_pub = tid_pub[pos]
+    lat_block = df_public[lat_cols].set_axis(rating_cols, axis=1)
+    brz_block = df_public[brz_cols].set_axis(rating_cols, axis=1)
+    df_public = df_public.drop(columns=lat_cols + brz_cols)
+    df_public[rating_cols] = lat_block.fillna(brz_block)
+    lap("merge: ratings")
+
+    # QA-оценки по (Tutor ID, дата): сначала LATAM, потом Brazil, как раньше
+    (pair_pub, pair_qlat, pair_qbrz), n_pair = key_codes(
+        [tid_pub, df_public["Date of the lesson"]],
+        [tid_qlat, q_lat["Date of the lesson"]],
+        [tid_qbrz, q_brz["Date of the lesson"]],
+    )
+    qa_cols = ["QA score", "QA marker"]
+    df_public, pos = indexed_left_join(df_public, q_lat.rename(columns={c: c + "_lat" for c in qa_cols}),
+                                       pair_pub, build_join_index(pair_qlat, n_pair),
+                                       [c + "_lat" for c in qa_cols])
+    tid_pub, pair_pub = tid_pub[pos], pair_pub[pos]
+    df_public, pos = indexed_left_join(df_public, q_brz.rename(columns={c: c + "_brz" for c in qa_cols}),
+                                       pair_pub, build_join_index(pair_qbrz, n_pair),
+                                       [c + "_brz" for c in qa_cols])
+    tid_pub = tid_pub[pos]
+    for base in qa_cols:
         df_public[base] = df_public[f"{base}_lat"].fillna(df_public[f"{base}_brz"])
         df_public.drop([f"{base}_lat", f"{base}_brz"], axis=1, inplace=True)
+    lap("merge: QA scores")
 
-    rp = load_replacements()
-    df_public = df_public.merge(rp, left_on=["Date of the lesson","Group"],
-                                right_on=["Date","Group"], how="left")
+    rp = src["repl"].result()
+    lap("wait: replacements")
+    (dg_pub, dg_rp), n_dg = key_codes(
+        [df_public["Date of the lesson"], df_public["Group"]],
+        [rp["Date"], rp["Group"]],
+    )
+    df_public, pos = indexed_left_join(df_public, rp, dg_pub, build_join_index(dg_rp, n_dg),
+                                       ["Replacement or not"])
+    tid_pub = tid_pub[pos]
     df_public["Replacement or not"] = df_public["Replacement or not"].fillna("")
-    df_public.drop(columns=["Date"], inplace=True)
+    lap("merge: replacements")
 
     # === Подшиваем QA evaluation датой ===
-    qa_all = pd.concat([load_qa(QA_LATAM_SS), load_qa(QA_BRAZIL_SS)], ignore_index=True)
+    qa_all = pd.concat([q_lat, q_brz], ignore_index=True)
     qa_all = qa_all.rename(columns={"Date of the lesson": "Eval Date"})
-    qa_all = qa_all[["Tutor ID", "QA score", "QA marker", "Eval Date"]]
-    df_public = df_public.merge(
-        qa_all,
-        left_on=["Tutor ID", "QA score", "QA marker", "Date of the lesson"],
-        right_on=["Tutor ID", "QA score", "QA marker", "Eval Date"],
-        how="left"
+    tid_qa = np.concatenate([tid_qlat, tid_qbrz])
+    (k4_pub, k4_qa), n_k4 = key_codes(
+        [tid_pub, df_public["QA score"], df_public["QA marker"], df_public["Date of the lesson"]],
+        [tid_qa, qa_all["QA score"], qa_all["QA marker"], qa_all["Eval Date"]],
     )
+    df_public, pos = indexed_left_join(df_public, qa_all, k4_pub, build_join_index(k4_qa, n_k4),
+                                       ["Eval Date"])
+    tid_pub = tid_pub[pos]
 
-    df_public["Eval Date"] = pd.to_datetime(df_public["Eval Date"], errors="coerce")
+    df_public["Eval Date"] = parse_dates(df_public["Eval Date"])
     df_public["Source"] = "Public"
+    lap("merge: Eval Date")
 
     # === QA-only: всё что не попало в публичные ===
-    df_qa_full = pd.concat([load_qa(QA_LATAM_SS), load_qa(QA_BRAZIL_SS)], ignore_index=True)
-    df_qa_full = df_qa_full.rename(columns={"Date of the lesson": "Eval Date"})
-    # Оставим только те строки, которых нет в df_public по 3-м полям
-    merged = df_qa_full.merge(
-        df_public[["Tutor ID", "QA score", "QA marker", "Eval Date"]],
-        on=["Tutor ID", "QA score", "QA marker", "Eval Date"],
-        how="left",
-        indicator=True
+    # анти-join по (Tutor ID, QA score, QA marker, Eval Date) через общие коды
+    (e4_qa, e4_pub), _ = key_codes(
+        [tid_qa, qa_all["QA score"], qa_all["QA marker"], qa_all["Eval Date"]],
+        [tid_pub, df_public["QA score"], df_public["QA marker"], df_public["Eval Date"]],
     )
-    df_qa_only = merged[merged["_merge"] == "left_only"].drop(columns=["_merge"])
+    only = ~np.isin(e4_qa, e4_pub)
+    df_qa_only = qa_all[only].reset_index(drop=True)
+    tid_qa_only = tid_qa[only]
     # Добавим пустые столбцы для совместимости
     for col in df_public.columns:
         if col not in df_qa_only.columns:
@@ -263,40 +675,199 @@ def build_df():
 
     # Совместим по структуре
     df_qa_only = df_qa_only[df_public.columns]
+    lap("QA-only anti-join")
 
     # Итоговый датафрейм: оба датафрейма вместе
     df = pd.concat([df_public, df_qa_only], ignore_index=True)
+    tid_df = np.concatenate([tid_pub, tid_qa_only])
+    lap("concat Public + QA")
 
-    # Заполняем пустые поля из публичных данных по Tutor ID
+    # Заполняем пустые поля из публичных данных по Tutor ID — одним блоком:
+    # для каждого кода берём первую публичную строку этого преподавателя
     static_cols = [
         "Tutor name", "Region", "Group", "Course ID", "Module", "Lesson", "Lesson Link",
         "Rating w retention", "Num of QA scores", "Num of QA scores (last 90 days)",
         "Average QA score", "Average QA score (last 2 scores within last 90 days)",
         "Average QA marker", "Average QA marker (last 2 markers within last 90 days)"
     ]
-    tutor_static = (
-        df_public
-        .dropna(subset=["Tutor ID"])[["Tutor ID"] + static_cols]
-        .drop_duplicates(subset=["Tutor ID"], keep="first")
-        .set_index("Tutor ID")
-    )
-    for col in static_cols:
-        df[col] = df[col].fillna(df["Tutor ID"].map(tutor_static[col]))
-        
+    has_tid = df_public["Tutor ID"].notna().to_numpy()
+    first_row = np.full(n_tid, -1)
+    uniq, first = np.unique(tid_pub[has_tid], return_index=True)
+    first_row[uniq] = np.flatnonzero(has_tid)[first]
+    static = take_rows(df_public[static_cols], first_row[tid_df])
+    df[static_cols] = df[static_cols].fillna(static)
+    lap("static-column backfill")
+
     # (опционально) — если нужна сортировка по дате
     # df = df.sort_values(by=["Eval Date", "Date of the lesson"], ascending=False)
 
     return df
 
+# === Индексы для мультиселектов ===
+def is_filterable(s: pd.Series) -> bool:
+    return (
+        pt.is_object_dtype(s) or pt.is_string_dtype(s)
+        or isinstance(s.dtype, pd.CategoricalDtype) or pt.is_numeric_dtype(s)
+    )
+
+def build_filter_index(df: pd.DataFrame) -> dict:
+    """
+    Для каждой фильтруемой колонки: отсортированный список опций и
+    для каждой опции — массив позиций строк, где она встречается.
+    Строится один раз на собранный кадр, а не на каждый rerun.
+    """
+    index = {}
+    for c in df.columns:
+        if not is_filterable(df[c]):
+            continue
+        try:
+            codes, uniques = pd.factorize(df[c], sort=True)
+        except TypeError:  # смешанные типы не сортируются
+            codes, uniques = pd.factorize(df[c])
+        order  = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        start  = int((codes < 0).sum())  # NaN (код -1) в начале order, пропускаем
+        positions = np.split(order[start:], np.cumsum(counts)[:-1]) if len(uniques) else []
+        options = list(uniques)
+        index[c] = {
+            "options":   options,
+            "positions": dict(zip(options, positions)),
+        }
+    return index
+
+def selection_mask(col_index: dict, selected: list, n_rows: int) -> np.ndarray:
+    """Маска строк для выбранных значений: работа пропорциональна числу выбранных строк."""
+    m = np.zeros(n_rows, dtype=bool)
+    for v in selected:
+        pos = col_index["positions"].get(v)
+        if pos is not None:
+            m[pos] = True
+    return m
+
+# === Снимок на диске ===
+def save_snapshot(df: pd.DataFrame, built_at: float) -> None:
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    meta = dict(table.schema.metadata or {})
+    meta[b"built_at"] = str(built_at).encode()
+    table = table.replace_schema_metadata(meta)
+    os.makedirs(os.path.dirname(SNAPSHOT_PATH) or ".", exist_ok=True)
+    tmp = SNAPSHOT_PATH + ".tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, SNAPSHOT_PATH)  # атомарно: читатель видит либо старый, либо новый файл
+
+def load_snapshot():
+    """(df, built_at) из снимка или None, если снимка нет или он не читается."""
+    if not os.path.exists(SNAPSHOT_PATH):
+        return None
+    try:
+        with pa.memory_map(SNAPSHOT_PATH) as source:
+            table = pa.ipc.open_file(source).read_all()
+        built_at = float(table.schema.metadata[b"built_at"])
+        return table.to_pandas(), built_at
+    except Exception as e:
+        logging.warning(f"Snapshot {SNAPSHOT_PATH} unreadable, ignoring: {e}")
+        return None
+
+# === Фоновое обновление (stale-while-revalidate) ===
+def refresh_dataset(holder: dict, wait: bool = False) -> None:
+    """
+    Пересобирает кадр и атомарно подменяет holder["data"].
+    Если сборка уже идёт: wait=False — выходим сразу, wait=True — ждём её.
+    При ошибке остаётся последний удачный кадр.
+    Стадии сборки пишутся в holder["profile"], с holder["cprofile"] — ещё и cProfile.
+    """
+    if not holder["build_lock"].acquire(blocking=wait):
+        return
+    profile = BuildProfile(cprofile=holder.get("cprofile", False))
+    token = _build_profile.set(profile)
+    try:
+        if wait and holder["data"] is not None:
+            return  # пока ждали, кадр собрал другой поток
+        started = time.monotonic()
+        try:
+            with stage("build_df"):
+                df = profile.runcall(build_df)
+            with stage("build_filter_index"):
+                data = (df, build_filter_index(df))
+        except Exception as e:
+            holder.update(error=f"{type(e).__name__}: {e}", profile=profile)
+            return
+        holder.update(
+            data=data,
+            built_at=time.time(),
+            duration=time.monotonic() - started,
+            error=None,
+            profile=profile,
+        )
+        try:
+            with stage("save_snapshot"):
+                save_snapshot(df, holder["built_at"])
+        except Exception as e:
+            logging.warning(f"Snapshot not saved: {e}")
+    finally:
+        _build_profile.reset(token)
+        holder["build_lock"].release()
+        try:
+            api_metrics.write_reports(METRICS_RUN)
+        except OSError as e:
+            logging.warning(f"API metrics not written: {e}")
+
+def start_background_refresh(holder: dict) -> None:
+    def loop():
+        # кадр из снимка обновляем, как только он старше REFRESH_INTERVAL
+        if holder["built_at"] is not None:
+            time.sleep(max(0.0, REFRESH_INTERVAL - (time.time() - holder["built_at"])))
+            refresh_dataset(holder)
+        while True:
+            time.sleep(REFRESH_INTERVAL)
+            refresh_dataset(holder)
+    threading.Thread(target=loop, name="dataset-refresh", daemon=True).start()
+
+@st.cache_resource(show_spinner=False)
+def get_dataset_holder() -> dict:
+    """Один на процесс контейнер с последним собранным кадром и его индексами фильтров."""
+    holder = {
+        "build_lock": threading.Lock(),
+        "data":       None,   # (df, filter_index)
+        "built_at":   None,
+        "duration":   None,
+        "error":      None,
+        "profile":    None,   # BuildProfile последней сборки
+        "cprofile":   False,  # писать cProfile следующих сборок (переключатель в админ-панели)
+    }
+    snapshot = load_snapshot()
+    if snapshot is not None:
+        df, built_at = snapshot
+        holder.update(data=(df, build_filter_index(df)), built_at=built_at)
+    start_background_refresh(holder)
+    return holder
+
+def get_dataset():
+    holder = get_dataset_holder()
+    if holder["data"] is None:
+        with st.spinner("Loading data…"):
+            refresh_dataset(holder, wait=True)
+    if holder["data"] is None:
+        st.error(f"Failed to load data: {holder['error']}")
+        st.stop()
+    return holder["data"]
+
 # === Streamlit UI ===
 check_app_password()
 
 # Кнопка выхода (опционально)
 if st.sidebar.button("🚪 Log out"):
     st.session_state["auth_ok"] = False
+    st.session_state["is_admin"] = False
     st.rerun()
 
-df = build_df()
+# замеры этого прогона (фильтры и отрисовка) — для админ-панели внизу
+ui_profile = BuildProfile()
+_build_profile.set(ui_profile)
+
+df, filter_index = get_dataset()
+lap("get_dataset")
 
 # 1. Чекбоксы
 show_public = st.sidebar.checkbox("Show public lessons", value=True)
@@ -349,9 +920,10 @@ else:
 
 # 4. Комбинированная маска (НЕ меняется!)
 mask = mask_public | mask_qa
+lap("filters: dates")
 
 if hide_na:
-    tid = df["Tutor ID"].fillna("").astype(str).str.strip().str.upper()
+    tid = df["Tutor ID"].astype("string").fillna("").str.strip().str.upper()
     mask &= (tid != "") & (tid != "#N/A")
 
 # 2) Остальные мультиселекты
@@ -359,23 +931,91 @@ st.sidebar.header("Filters")
 filters = {
     c: st.sidebar.multiselect(
         c,
-        sorted(df[c].dropna().unique()),
+        filter_index[c]["options"],
         default=[]
     )
     for c in df.columns
-    if df[c].dtype == object or pt.is_numeric_dtype(df[c])
+    if c in filter_index
 }
 
 # добавляем остальные условия к той же маске
 for c, sel in filters.items():
     if sel:
-        mask &= df[c].isin(sel)
+        mask &= selection_mask(filter_index[c], sel, len(df))
 
 dff = df[mask]
+lap("filters: multiselect")
+
+holder = get_dataset_holder()
+age_min = (time.time() - holder["built_at"]) / 60
+if holder["duration"] is None:
+    st.sidebar.caption(f"Data age: {age_min:.0f} min (from disk snapshot, refresh pending)")
+else:
+    st.sidebar.caption(f"Data age: {age_min:.0f} min, last refresh took {holder['duration']:.1f}s")
+if holder["error"]:
+    st.sidebar.warning(f"Last refresh failed, showing previous data: {holder['error']}")
+if st.sidebar.button("🔄 Refresh data"):
+    threading.Thread(target=refresh_dataset, args=(holder,), daemon=True).start()
+    st.sidebar.info("Refresh started in background")
+
+mem = df.attrs.get("memory_mb")
+if mem:
+    st.sidebar.caption(f"Frame memory: {mem[0]:.1f} MB raw → {mem[1]:.1f} MB typed")
+
+fc = get_api_counters()
+st.sidebar.caption(
+    f"Sheets API: {fc['fetches']} values reads, "
+    f"token refreshes: {fc['token_refreshes']}"
+)
 
 st.title("📊 QA queue (Latam and Brazil)")
 row_count = dff.shape[0]
-st.markdown(f"**Rows displayed:** {row_count}")
-st.dataframe(dff, use_container_width=True)
-csv = dff.to_csv(index=False)
-st.download_button("📥 Download CSV", csv, "qa_dashboard.csv", "text/csv")
+
+# Пагинация и сортировка: режем только видимое окно из отфильтрованного кадра
+col_size, col_sort, col_desc, col_page = st.columns([1, 2, 1, 1])
+page_size = col_size.selectbox("Rows per page", PAGE_SIZES, index=1)
+sort_col  = col_sort.selectbox("Sort by", ["—"] + list(df.columns))
+sort_desc = col_desc.checkbox("Descending", value=False)
+n_pages   = max(1, -(-row_count // page_size))
+if st.session_state.get("page", 1) > n_pages:
+    st.session_state["page"] = n_pages
+page = col_page.number_input("Page", min_value=1, max_value=n_pages, step=1, key="page")
+
+start = (page - 1) * page_size
+end   = min(start + page_size, row_count)
+if sort_col != "—":
+    key = dff[sort_col]
+    try:
+        order = key.sort_values(ascending=not sort_desc, kind="stable", na_position="last").index
+    except TypeError:  # смешанные типы в object-колонке
+        order = key.astype(str).sort_values(ascending=not sort_desc, kind="stable").index
+    page_df = dff.loc[order[start:end]]
+else:
+    page_df = dff.iloc[start:end]
+lap("sort + page")
+
+st.markdown(f"**Rows displayed:** {start + 1 if row_count else 0}–{end} of {row_count} (page {page}/{n_pages})")
+st.dataframe(page_df, use_container_width=True)
+lap("render table")
+# CSV со всеми отфильтрованными строками собирается только по клику
+st.download_button("📥 Download CSV", lambda: dff.to_csv(index=False), "qa_dashboard.csv", "text/csv")
+
+# === Админ-панель: стадии сборки и прогона UI, cProfile ===
+if st.session_state.get("is_admin"):
+    with st.sidebar.expander("⏱ Profiling (admin)"):
+        holder["cprofile"] = st.toggle(
+            "cProfile rebuilds", value=holder["cprofile"],
+            help="Process-wide: every rebuild is profiled while this is on. Press 🔄 Refresh data to start one.",
+        )
+        build_profile = holder["profile"]
+        if build_profile is None:
+            st.caption("No rebuild in this process yet (data from disk snapshot).")
+        else:
+            st.caption("Last rebuild: seconds and RSS delta per stage")
+            st.dataframe(build_profile.frame(), hide_index=True)
+            if build_profile.profilers:
+                st.download_button("📥 Download pstats", lambda: build_profile.pstats_dump(),
+                                   "qa_dashboard_rebuild.pstats", "application/octet-stream")
+                st.code(build_profile.pstats_top(25))
+        st.caption("This page run")
+        st.dataframe(ui_profile.frame(), hide_index=True)
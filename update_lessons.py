@@ -1,14 +1,16 @@
 #!/usr/bin/env python3
 import os
 import json
+import hashlib
 import logging
-import time
 
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from gspread_dataframe import set_with_dataframe
-from gspread.exceptions import APIError, WorksheetNotFound
+from gspread.exceptions import WorksheetNotFound
+from gspread.utils import absolute_range_name
+
+from sheets_client import api_retry, open_spreadsheet, open_worksheet
+from source_state import sources_changed, remember
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
@@ -19,27 +21,16 @@ SRC_SHEET_NAME_2   = "QA Workspace Graduations"
 
 DST_SS_ID          = "1njy8V5lyG3vyENr1b50qGd3infU4VHYP4CfaD0H1AlM"
 DST_SHEET_NAME     = "Lessons"
+
+# "diff" — пишем только изменившиеся строки, "full" — очистка и полная перезапись
+WRITE_MODE         = "diff"
+# Как Sheets показывает записанные нами строки (USER_ENTERED: "007" -> "7", "0.50" -> "0.5"):
+# хэш строки источника -> хэш той же строки в листе, чтобы diff не переписывал их каждый запуск
+RENDER_MEMO_FILE   = os.environ.get("LESSONS_RENDER_FILE", ".update_lessons_render.json")
 # ————————————————————————————————
 
-SERVICE_ACCOUNT_JSON = json.loads(os.environ["GCP_SERVICE_ACCOUNT"])
 COLS_15 = [chr(ord("A") + i) for i in range(15)]  # ["A", ..., "O"]
 
-def api_retry(func, *args, max_attempts=5, initial_backoff=1.0, **kwargs):
-    backoff = initial_backoff
-    for attempt in range(1, max_attempts + 1):
-        try:
-            return func(*args, **kwargs)
-        except APIError as e:
-            code = None
-            if e.response:
-                code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and attempt < max_attempts:
-                logging.warning(f"API {code} on attempt {attempt}, retrying in {backoff:.1f}s…")
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            raise
-
 def extract_next_after_tutor(rows, width=15):
     out = []
     for i, r in enumerate(rows):
@@ -50,9 +41,9 @@ def extract_next_after_tutor(rows, width=15):
             out.append(nxt)
     return out
 
-def read_source_df(sh_src, sheet_name):
+def read_source_df(sheet_name):
     try:
-        ws = api_retry(sh_src.worksheet, sheet_name)
+        ws = open_worksheet(SRC_SS_ID, sheet_name)
     except WorksheetNotFound:
         logging.warning(f"Sheet '{sheet_name}' not found, skipping.")
         return None
@@ -73,19 +64,16 @@ def read_source_df(sh_src, sheet_name):
     return df
 
 def main():
-    # 1) Авторизация
-    scope  = ["https://spreadsheets.google.com/feeds","https://www.googleapis.com/auth/drive"]
-    creds  = ServiceAccountCredentials.from_json_keyfile_dict(SERVICE_ACCOUNT_JSON, scope)
-    client = gspread.authorize(creds)
-    logging.info("✔ Authenticated to Google Sheets")
-
-    # 2) Источник
-    sh_src = api_retry(client.open_by_key, SRC_SS_ID)
+    # 0) Если источник не менялся с прошлого успешного запуска — ничего не делаем
+    changed, fingerprints = sources_changed("update_lessons", [SRC_SS_ID])
+    if not changed:
+        logging.info("✔ Source unchanged since last run, skipping")
+        return None
 
-    # 3) Читаем оба листа и объединяем
+    # 1) Читаем оба листа источника и объединяем
     df_list = []
     for sheet_name in (SRC_SHEET_NAME_1, SRC_SHEET_NAME_2):
-        df = read_source_df(sh_src, sheet_name)
+        df = read_source_df(sheet_name)
         if df is not None:
             # На всякий случай ещё раз нормализуем имена (если функцию кто-то поменяет)
             df.columns = COLS_15
@@ -97,11 +85,19 @@ def main():
 
     df_all = pd.concat(df_list, ignore_index=True)
 
-    # 4) Запись в целевой лист (A2:O)
-    sh_dst = api_retry(client.open_by_key, DST_SS_ID)
-    ws_dst = api_retry(sh_dst.worksheet, DST_SHEET_NAME)
+    # 2) Запись в целевой лист (A2:O)
+    sh_dst = open_spreadsheet(DST_SS_ID)
+    ws_dst = open_worksheet(DST_SS_ID, DST_SHEET_NAME)
 
     existing = api_retry(ws_dst.get, "A2:O")
+    if WRITE_MODE == "diff":
+        write_diff(sh_dst, existing, df_all)
+    else:
+        write_full(ws_dst, existing, df_all)
+    remember("update_lessons", fingerprints)
+    return df_all
+
+def write_full(ws_dst, existing, df_all):
     end_row = 1 + len(existing)  # A2…A{end_row}
     if end_row >= 2:
         api_retry(ws_dst.batch_clear, [f"A2:O{end_row}"])
@@ -119,5 +115,90 @@ def main():
 
     logging.info(f"✔ Written {len(df_all)} rows to '{DST_SHEET_NAME}' starting at A2:O")
 
+def pad_row(row, width=15):
+    row = ["" if v is None else str(v) for v in row[:width]]
+    return row + [""] * (width - len(row))
+
+def row_hash(row):
+    return hashlib.blake2b("\x1f".join(row).encode("utf-8"), digest_size=16).hexdigest()
+
+def load_render_memo():
+    try:
+        with open(RENDER_MEMO_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+def save_render_memo(memo):
+    tmp = RENDER_MEMO_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(memo, f)
+    os.replace(tmp, RENDER_MEMO_FILE)
+
+def diff_row_ranges(existing, new_rows, width=15, rendered=None):
+    """
+    Позиционный diff: сравнивает строки A2:O построчно и возвращает список
+    (first_idx, last_idx) для непрерывных блоков изменённых строк (0-based).
+    Лишние строки в конце целевого листа считаются удалёнными и затираются пустыми.
+    rendered — хэш строки источника -> хэш того, как её показал лист после записи:
+    такая строка в листе тоже считается совпавшей.
+    """
+    rendered = rendered or {}
+    total = max(len(existing), len(new_rows))
+    blank = [""] * width
+    ranges = []
+    start = None
+    for i in range(total):
+        old = pad_row(existing[i], width) if i < len(existing) else blank
+        new = new_rows[i] if i < len(new_rows) else blank
+        if old != new and rendered.get(row_hash(new)) != row_hash(old):
+            if start is None:
+                start = i
+        elif start is not None:
+            ranges.append((start, i - 1))
+            start = None
+    if start is not None:
+        ranges.append((start, total - 1))
+    return ranges
+
+def write_diff(sh_dst, existing, df_all, width=15):
+    new_rows = [pad_row(r, width) for r in df_all.astype(str).values.tolist()]
+    memo = load_render_memo()
+    ranges = diff_row_ranges(existing, new_rows, width, memo)
+    if not ranges:
+        logging.info(f"✔ '{DST_SHEET_NAME}' is up to date, nothing to write.")
+        return
+
+    blank = [""] * width
+    data = []
+    changed = 0
+    for first, last in ranges:
+        values = [new_rows[i] if i < len(new_rows) else blank for i in range(first, last + 1)]
+        data.append({
+            "range": absolute_range_name(DST_SHEET_NAME, f"A{first + 2}:O{last + 2}"),
+            "values": values,
+        })
+        changed += len(values)
+
+    # ответ сразу несёт записанное в том виде, как его покажет лист, — без отдельного чтения
+    resp = api_retry(sh_dst.values_batch_update, {
+        "valueInputOption": "USER_ENTERED",
+        "data": data,
+        "includeValuesInResponse": True,
+        "responseValueRenderOption": "FORMATTED_VALUE",
+    })
+    for (first, last), r in zip(ranges, resp.get("responses", [])):
+        shown = r.get("updatedData", {}).get("values", [])
+        for k, i in enumerate(range(first, min(last + 1, len(new_rows)))):
+            got = pad_row(shown[k], width) if k < len(shown) else blank
+            if got != new_rows[i]:
+                memo[row_hash(new_rows[i])] = row_hash(got)
+    current = {row_hash(r) for r in new_rows}
+    save_render_memo({k: v for k, v in memo.items() if k in current})
+    logging.info(
+        f"✔ Diff-written {changed} rows in {len(data)} ranges to '{DST_SHEET_NAME}' "
+        f"({len(df_all)} rows total, {len(existing)} before)"
+    )
+
 if __name__ == "__main__":
     main()
@@ -1,17 +1,16 @@
 #!/usr/bin/env python3
-import os
-import json
 import logging
-import time
-from typing import List
+from bisect import bisect_right
+from typing import List, Tuple
 
+import numpy as np
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
 from gspread_dataframe import set_with_dataframe
-from gspread.exceptions import APIError, WorksheetNotFound
 from gspread.utils import rowcol_to_a1
 
+from sheets_client import api_retry, open_worksheet
+from source_state import sources_changed, remember
+
 # —————————————————————————————
 SOURCE_SS_ID      = "1xqGCXsebSmYL4bqAwvTmD9lOentI45CTMxhea-ZDFls"
 SOURCE_SHEET_NAME = "Tutors"
@@ -23,39 +22,6 @@ DEST_SHEET_NAME   = "Tutors"
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
 
 
-def api_retry_open(client, key, max_attempts=5, backoff=1.0):
-    for i in range(1, max_attempts + 1):
-        try:
-            logging.info(f"open_by_key attempt {i}/{max_attempts}")
-            return client.open_by_key(key)
-        except APIError as e:
-            code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and i < max_attempts:
-                logging.warning(f"Received {code} — retrying in {backoff:.1f}s")
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            raise
-
-
-def api_retry_worksheet(sh, title, max_attempts=5, backoff=1.0):
-    for i in range(1, max_attempts + 1):
-        try:
-            logging.info(f"worksheet('{title}') attempt {i}/{max_attempts}")
-            return sh.worksheet(title)
-        except APIError as e:
-            code = getattr(e.response, "status_code", None) or getattr(e.response, "status", None)
-            if code and 500 <= int(code) < 600 and i < max_attempts:
-                logging.warning(f"Received {code} — retrying in {backoff:.1f}s")
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            raise
-        except WorksheetNotFound:
-            logging.error(f"Worksheet '{title}' not found")
-            raise
-
-
 def dedupe_preserve_order(seq: List[int]) -> List[int]:
     seen = set()
     out = []
@@ -66,80 +32,76 @@ def dedupe_preserve_order(seq: List[int]) -> List[int]:
     return out
 
 
-def fetch_columns(ws, cols_idx: List[int], max_attempts=5, backoff=1.0) -> pd.DataFrame:
+def col_letter(idx: int) -> str:
+    return ''.join(filter(str.isalpha, rowcol_to_a1(1, idx + 1)))   # 0 -> "A", 49 -> "AX"
+
+
+def coalesce_ranges(cols_idx: List[int]) -> List[Tuple[int, int]]:
+    """
+    Merge adjacent column indices into inclusive blocks:
+    [0, 1, 2, 6, 7, 8, 21] -> [(0, 2), (6, 8), (21, 21)].
     """
-    Download only needed columns (0-based indices) via batch_get().
-    Pads columns to equal length so we don't truncate rows.
+    blocks = []
+    for idx in sorted(set(cols_idx)):
+        if blocks and idx == blocks[-1][1] + 1:
+            blocks[-1] = (blocks[-1][0], idx)
+        else:
+            blocks.append((idx, idx))
+    return blocks
+
+
+def fetch_columns(ws, cols_idx: List[int]) -> pd.DataFrame:
+    """
+    Download only needed columns (0-based indices) via one batch_get().
+    Adjacent columns are fetched as one block range (e.g. G1:O), blocks are
+    padded to equal length so we don't truncate rows, then the requested
+    columns are taken back out in the requested order.
     Returns a DataFrame with headers from row 1 of each column.
     """
     cols_idx = dedupe_preserve_order(cols_idx)
-
-    for attempt in range(1, max_attempts + 1):
-        try:
-            ranges = []
-            col_letters = []
-
-            for idx in cols_idx:
-                a1 = rowcol_to_a1(1, idx + 1)             # "A1", "B1", ...
-                col = ''.join(filter(str.isalpha, a1))    # "A", "B", ...
-                col_letters.append(col)
-                ranges.append(f"{col}1:{col}")
-
-            batch = ws.batch_get(ranges)  # list of columns, each: [[v1],[v2],...] or []
-
-            cols = []
-            for col_vals in batch:
-                flat = [(r[0] if r else "") for r in col_vals] if col_vals else []
-                cols.append(flat)
-
-            max_len = max((len(c) for c in cols), default=0)
-            if max_len == 0:
-                return pd.DataFrame()
-
-            padded_cols = []
-            for c in cols:
-                if len(c) < max_len:
-                    c = c + [""] * (max_len - len(c))
-                padded_cols.append(c)
-
-            headers = []
-            for i, c in enumerate(padded_cols):
-                h = c[0] if c else ""
-                if not str(h).strip():
-                    h = f"__{col_letters[i]}__"
-                headers.append(h)
-
-            data_rows = list(zip(*(c[1:] for c in padded_cols)))
-            return pd.DataFrame(data_rows, columns=headers)
-
-        except Exception as e:
-            if attempt < max_attempts:
-                logging.warning(f"batch_get error (attempt {attempt}): {e} — retrying in {backoff:.1f}s")
-                time.sleep(backoff)
-                backoff *= 2
-                continue
-            logging.error(f"batch_get failed after {attempt} attempts: {e}")
-            raise
+    blocks = coalesce_ranges(cols_idx)
+    ranges = [f"{col_letter(a)}1:{col_letter(b)}" for a, b in blocks]
+    logging.info(f"batch_get {len(cols_idx)} columns as {len(ranges)} ranges {ranges}")
+
+    batch = api_retry(ws.batch_get, ranges)  # list of blocks, each: rows of up to (b - a + 1) values
+
+    max_len = max((len(vals) for vals in batch), default=0)
+    if max_len == 0:
+        return pd.DataFrame()
+
+    # Each block -> (max_len x width) array, short rows/blocks padded with ""
+    arrays, offset = [], {}
+    pos = 0
+    for (a, b), vals in zip(blocks, batch):
+        width = b - a + 1
+        block = pd.DataFrame(list(vals)).reindex(index=range(max_len), columns=range(width))
+        arrays.append(block.fillna("").to_numpy(dtype=object))
+        offset[a] = pos - a
+        pos += width
+    starts = [a for a, _ in blocks]
+    wide = np.hstack(arrays)
+
+    take = [offset[starts[bisect_right(starts, idx) - 1]] + idx for idx in cols_idx]
+    picked = wide[:, take]
+
+    headers = [
+        h if str(h).strip() else f"__{col_letter(idx)}__"
+        for h, idx in zip(picked[0], cols_idx)
+    ]
+    return pd.DataFrame(picked[1:], columns=headers)
 
 
 def main():
-    # 1) Auth
-    scope = [
-        "https://spreadsheets.google.com/feeds",
-        "https://www.googleapis.com/auth/drive",
-    ]
-    creds = ServiceAccountCredentials.from_json_keyfile_dict(
-        json.loads(os.environ["GCP_SERVICE_ACCOUNT"]),
-        scope,
-    )
-    client = gspread.authorize(creds)
-    logging.info("✔ Authenticated to Google Sheets")
+    # 0) Если источник не менялся с прошлого успешного запуска — ничего не делаем
+    changed, fingerprints = sources_changed("update_tutors_qa", [SOURCE_SS_ID])
+    if not changed:
+        logging.info("✔ Source unchanged since last run, skipping")
+        return None
 
-    # 2) Source
-    sh_src = api_retry_open(client, SOURCE_SS_ID)
-    ws_src = api_retry_worksheet(sh_src, SOURCE_SHEET_NAME)
+    # 1) Источник
+    ws_src = open_worksheet(SOURCE_SS_ID, SOURCE_SHEET_NAME)
 
-    # 3) Columns to take (0-based). BH is NOT included.
+    # 2) Какие колонки берём (0-based). BH НЕ берём.
     cols_to_take = [0, 1, 2, 21, 4, 15, 16]             # A, B, C, V, E, P, Q
     cols_to_take += list(range(6, 15))                  # G..O (6..14)
     cols_to_take += [25, 31, 41, 46]                    # Z, AF, AP, AU
@@ -151,29 +113,29 @@ def main():
     if df.empty:
         raise ValueError("Fetched DataFrame is empty — check source sheet/ranges.")
 
-    # 4) Destination
-    sh_dst = api_retry_open(client, DEST_SS_ID)
-    ws_dst = api_retry_worksheet(sh_dst, DEST_SHEET_NAME)
+    # 3) Приёмник
+    ws_dst = open_worksheet(DEST_SS_ID, DEST_SHEET_NAME)
 
     # Пишем ВСЁ начиная со 2-й строки:
-    # row 2 = заголовки, row 3.. = данные
+    # строка 2 = заголовки, строки 3.. = данные
     START_ROW = 2
 
     target_cols = int(df.shape[1])
-    end_col = ''.join(filter(str.isalpha, rowcol_to_a1(1, target_cols)))  # e.g. "AK"
+    end_col = ''.join(filter(str.isalpha, rowcol_to_a1(1, target_cols)))  # например "AK"
     logging.info(f"Will overwrite DEST columns A:{end_col} starting from row {START_ROW}")
 
     # Не уменьшаем лист, только расширяем вниз если надо
     # Нужно место под: 1 строка заголовков + N строк данных, начиная с START_ROW
-    needed_rows = START_ROW + df.shape[0]  # header at START_ROW + data rows below
+    needed_rows = START_ROW + df.shape[0]  # заголовок в START_ROW + строки данных под ним
     if ws_dst.row_count < needed_rows:
-        ws_dst.resize(rows=needed_rows)
+        api_retry(ws_dst.resize, rows=needed_rows)
 
     # Чистим только то, что перезапишем: A..end_col, начиная со строки 2
-    ws_dst.batch_clear([f"A{START_ROW}:{end_col}{ws_dst.row_count}"])
+    api_retry(ws_dst.batch_clear, [f"A{START_ROW}:{end_col}{ws_dst.row_count}"])
 
     # Пишем с A2 С заголовками (они попадут в строку 2)
-    set_with_dataframe(
+    api_retry(
+        set_with_dataframe,
         ws_dst,
         df,
         row=START_ROW,
@@ -183,6 +145,8 @@ def main():
     )
 
     logging.info(f"✔ Written to '{DEST_SHEET_NAME}' — rows={df.shape[0]} cols={df.shape[1]}")
+    remember("update_tutors_qa", fingerprints)
+    return df
 
 
 if __name__ == "__main__":